@@ -1,13 +1,28 @@
-from gui.MainWindow import MainWindow
-from PyQt5.QtCore import *
-from PyQt5.QtWidgets import *
+import sys
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # headless mode, must not import PyQt5
+        from utils.batch import main as batch_main
+
+        return batch_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "video":
+        from utils.video import main as video_main
+
+        return video_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "trace":
+        from utils.trace import main as trace_main
+
+        return trace_main(sys.argv[2:])
+
+    from gui.MainWindow import MainWindow
+    from PyQt5.QtWidgets import QApplication
+
     bart = QApplication([])
     mw = MainWindow()
     bart.exec_()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
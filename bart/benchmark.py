@@ -0,0 +1,276 @@
+"""
+Benchmark of ImageEffects operations across image sizes
+
+Usage (from the bart directory):
+    python benchmark.py run -o results.json [--sizes 0.3 2] [-k blur]
+    python benchmark.py compare baseline.json results.json [--threshold 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from utils.ImageEffects import ImageEffects as effects
+
+SIZES = (0.3, 2, 12, 24)
+
+# (effect, params) measured at every size
+CASES = [
+    ("get_rotated_image", {"angle": 45}),
+    ("get_rotated_image", {"angle": 90}),
+    ("get_sharpen_image", {"degree": 1}),
+    ("get_blured_image", {"degree": 5}),
+    ("get_blured_image", {"degree": 15}),
+    ("get_blured_image", {"degree": 99}),
+    ("get_sharpen_image", {"degree": 1, "radius": 10}),
+    ("get_inverted_image_colors", {}),
+    ("get_embossed_image", {"degree": 128}),
+    ("get_rgb_modified_image", {"color": [20, 0, -20]}),
+    ("get_brightness_modified_image", {"degree": 50}),
+    ("get_contrast_modified_image", {"degree": 1}),
+    ("get_contrast_modified_image", {"degree": 2}),
+    ("get_warped_image", {"points": "inset"}),
+    ("get_transformed_image", {"angle": 90}),
+    ("get_transformed_image", {"angle": 100, "points": "inset"}),
+    ("get_noise", {"degree": 0.01}),
+    ("get_grain_image", {"degree": 0.01}),
+    ("get_denoised_image", {"degree": 10}),
+    ("get_denoised_image", {"degree": 50}),
+    ("get_denoised_image", {"degree": 50, "mode": "fast"}),
+    ("get_vignette_image", {"degree": 300}),
+    ("get_perlin_noise", {"scale": 0.01, "octaves": 3}),
+]
+
+# effects taking (height, width) instead of an image
+SIZE_EFFECTS = ("get_perlin_noise",)
+
+
+def get_image(megapixels: float, path: Optional[str] = None) -> np.ndarray:
+    """
+    Returns BGR image of given size, synthetic unless path is given
+    """
+    width = int(round((megapixels * 1e6 * 3 / 2) ** 0.5))
+    height = int(round(width * 2 / 3))
+    if path:
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError("Could not open image: %s" % path)
+        return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    for channel in range(3):
+        noise = rng.normal(0, 20, (height, width)).astype(np.float32)
+        image[:, :, channel] = np.clip(gradient + noise + channel * 40, 0, 255)
+    return image
+
+
+def _resolve_params(params: dict, image: np.ndarray) -> dict:
+    params = dict(params)
+    if params.get("points") == "inset":
+        height, width = image.shape[:2]
+        dx, dy = width * 0.05, height * 0.05
+        params["points"] = np.float32(
+            [[dx, dy], [width - dx, 0], [0, height - dy], [width, height]]
+        )
+    if "color" in params:
+        params["color"] = np.array(params["color"])
+    return params
+
+
+class PeakMemory:
+    """Samples resident memory in a background thread"""
+
+    def __init__(self, interval: float = 0.002):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self.baseline = self.peak = _get_rss()
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _get_rss())
+            time.sleep(self._interval)
+
+    def __enter__(self) -> "PeakMemory":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _get_rss())
+
+    @property
+    def increase(self) -> int:
+        return self.peak - self.baseline
+
+
+def _get_rss() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def time_case(
+    function: Callable, args: tuple, params: dict, repeat: int
+) -> Tuple[List[float], int]:
+    """
+    Returns wall times of repeated calls and peak memory increase in bytes
+    """
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            function(*args, **params)
+            times.append(time.perf_counter() - start)
+        peak = max(peak, memory.increase)
+    return times, peak
+
+
+def run(
+    sizes=SIZES,
+    repeat: int = 3,
+    image_path: Optional[str] = None,
+    keyword: Optional[str] = None,
+    stream=sys.stdout,
+) -> dict:
+    results = []
+    for megapixels in sizes:
+        image = get_image(megapixels, image_path)
+        height, width = image.shape[:2]
+        for name, params in CASES:
+            if keyword and keyword not in name:
+                continue
+            function = getattr(effects, name)
+            args = (height, width) if name in SIZE_EFFECTS else (image,)
+            result = {
+                "effect": name,
+                "params": params,
+                "megapixels": megapixels,
+                "width": width,
+                "height": height,
+                "repeat": repeat,
+            }
+            try:
+                times, peak = time_case(
+                    function, args, _resolve_params(params, image), repeat
+                )
+                median = statistics.median(times)
+                result.update(
+                    time_min=min(times),
+                    time_median=median,
+                    peak_memory_mb=peak / 2**20,
+                    throughput_mps=width * height / 1e6 / median,
+                )
+                status = "%8.1f ms %8.1f MP/s %8.1f MB" % (
+                    median * 1e3,
+                    result["throughput_mps"],
+                    result["peak_memory_mb"],
+                )
+            except Exception as exc:
+                result["error"] = "%s: %s" % (type(exc).__name__, exc)
+                status = "FAILED " + result["error"]
+            results.append(result)
+            print(
+                "%5.1f MP %-32s %-28s %s"
+                % (megapixels, name, json.dumps(params), status),
+                file=stream,
+                flush=True,
+            )
+    return {"meta": get_meta(), "results": results}
+
+
+def get_meta() -> dict:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _key(result: dict) -> tuple:
+    return (
+        result["effect"],
+        json.dumps(result["params"], sort_keys=True),
+        result["megapixels"],
+    )
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2) -> List[dict]:
+    """
+    Returns cases whose median time grew by more than threshold
+    """
+    previous = {_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(_key(result))
+        if old is None or "time_median" not in old or "time_median" not in result:
+            continue
+        ratio = result["time_median"] / old["time_median"]
+        if ratio > 1 + threshold:
+            regressions.append(dict(result, ratio=ratio))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ImageEffects")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmark")
+    run_parser.add_argument("-o", "--output", default="benchmark.json")
+    run_parser.add_argument("--sizes", type=float, nargs="+", default=SIZES)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--image", help="use resized image instead of synthetic")
+    run_parser.add_argument("-k", "--keyword", help="run only matching effects")
+
+    compare_parser = commands.add_parser("compare", help="compare with baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(args.sizes, args.repeat, args.image, args.keyword)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    with open(args.current, encoding="utf-8") as file:
+        current = json.load(file)
+    regressions = compare(baseline, current, args.threshold)
+    for result in regressions:
+        print(
+            "REGRESSION %5.1f MP %-32s %s %.2fx slower"
+            % (
+                result["megapixels"],
+                result["effect"],
+                json.dumps(result["params"]),
+                result["ratio"],
+            )
+        )
+    print("%d regressions" % len(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
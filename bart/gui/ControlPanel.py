@@ -1,12 +1,22 @@
-from utils.ImageEffects import ImageEffects as effects
+from functools import partial
+from typing import Sequence
+
 from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QVBoxLayout, QPushButton, QLabel, QWidget
+from PyQt5.QtWidgets import QCheckBox, QVBoxLayout, QPushButton, QLabel, QWidget
 from gui.Slider import Slider
+from gui.WarpDialog import WarpDialog
+from utils.registry import CHECK, SLIDER, TOGGLE, Effect, Param, get_effects
 from utils.State import State
 
 
 class ControlPanel(QWidget):
-    """Custom QWidget containing control sliders and buttons"""
+    """
+    Custom QWidget containing control sliders and buttons
+
+    Controls of effect parameters are generated from the effect registry,
+    buttons first and then sliders and check boxes in pipeline order.
+    Controls of effects registered later are added with add_effects.
+    """
 
     def __init__(self, parent):
         super(QWidget, self).__init__(parent)
@@ -14,40 +24,62 @@ class ControlPanel(QWidget):
         self.layout = QVBoxLayout()
         self.widgets = {
             "rotate_btn": QPushButton(text="Otočit o 90°", parent=self),
-            "invert_btn": QPushButton(text="Inverze barev", parent=self),
-            "vignette_btn": QPushButton(text="Vinětace", parent=self),
-            "emboss_btn": QPushButton(text="Emboss", parent=self),
-            "sharpen_label": QLabel(text="Zaostření", parent=self),
-            "sharpen_sldr": Slider(Qt.Horizontal, parent, 0, 2),
-            "blur_label": QLabel(text="Rozmazání", parent=self),
-            "blur_sldr": Slider(Qt.Horizontal, parent, 1, 15, is_odd=True),
-            "brightness_label": QLabel(text="Jas", parent=self),
-            "brightness_sldr": Slider(Qt.Horizontal, parent, 0, 20),
-            "contrast_label": QLabel(text="Kontrast", parent=self),
-            "contrast_sldr": Slider(Qt.Horizontal, parent, 0, 2),
-            "perlin_label": QLabel(text="Šum", parent=self),
-            "perlin_noise_sldr": Slider(Qt.Horizontal, parent, 0, 2),
-            "denoise_label": QLabel(text="Redukce šumu", parent=self),
-            "denoise_sldr": Slider(Qt.Horizontal, parent, 0, 50),
-            "reset_btn": QPushButton(text="Reset", parent=self),
+            "warp_btn": QPushButton(text="Korekce perspektivy", parent=self),
         }
-
         self.widgets["rotate_btn"].clicked.connect(self.on_rotate_btn_click)
-        self.widgets["invert_btn"].clicked.connect(self.on_invert_btn_click)
-        self.widgets["vignette_btn"].clicked.connect(self.on_vignette_btn_click)
-        self.widgets["emboss_btn"].clicked.connect(self.on_emboss_btn_click)
+        self.widgets["warp_btn"].clicked.connect(self.on_warp_btn_click)
+
+        self.add_effects(get_effects())
+
+        self.widgets["reset_btn"] = QPushButton(text="Reset", parent=self)
         self.widgets["reset_btn"].clicked.connect(self.on_reset_btn_click)
 
-        self.widgets["sharpen_sldr"].valueChanged.connect(self.on_sharpen_sldr_move)
-        self.widgets["blur_sldr"].valueChanged.connect(self.on_blur_sldr_move)
-        self.widgets["brightness_sldr"].valueChanged.connect(
-            self.on_brightness_sldr_move
+        self.init_layout()
+
+    def add_effects(self, effects: Sequence[Effect]) -> None:
+        """
+        Adds controls of the effects, above the reset button once it exists
+        """
+        known = set(self.widgets)
+        params = [param for effect in effects for param in effect.params]
+        for param in params:
+            if param.kind == TOGGLE:
+                self._add_toggle(param)
+        for param in params:
+            if param.kind == SLIDER:
+                self._add_slider(param)
+            elif param.kind == CHECK:
+                self._add_check(param)
+
+        reset_btn = self.widgets.get("reset_btn")
+        if reset_btn is not None:
+            for name, widget in self.widgets.items():
+                if name not in known:
+                    self.layout.insertWidget(self.layout.indexOf(reset_btn), widget)
+
+    def _add_toggle(self, param: Param) -> None:
+        button = QPushButton(text=param.label, parent=self)
+        button.clicked.connect(partial(self.on_toggle_click, param.name))
+        self.widgets[param.name + "_btn"] = button
+
+    def _add_slider(self, param: Param) -> None:
+        self.widgets[param.name + "_label"] = QLabel(text=param.label, parent=self)
+        slider = Slider(
+            Qt.Horizontal,
+            self,
+            param.minimum,
+            param.maximum,
+            is_odd=param.odd,
+            default_value=param.default,
         )
-        self.widgets["contrast_sldr"].valueChanged.connect(self.on_contrast_sldr_move)
-        self.widgets["perlin_noise_sldr"].valueChanged.connect(self.on_noise_sldr_move)
-        self.widgets["denoise_sldr"].valueChanged.connect(self.on_denoise_sldr_move)
+        slider.valueChanged.connect(partial(self.on_slider_move, param))
+        self.widgets[param.name + "_sldr"] = slider
 
-        self.init_layout()
+    def _add_check(self, param: Param) -> None:
+        box = QCheckBox(text=param.label, parent=self)
+        box.setChecked(param.default)
+        box.toggled.connect(partial(self.on_check_toggle, param.name))
+        self.widgets[param.name + "_box"] = box
 
     def init_layout(self):
         """Initialize widget layout"""
@@ -55,119 +87,55 @@ class ControlPanel(QWidget):
             self.layout.addWidget(w)
         self.setLayout(self.layout)
 
-    def _return_to_previous_state(self) -> State:
-        """Fallback to previous state"""
-        return self.parent.states.pop()
+    def set_state(self, state: State) -> None:
+        """Move sliders to values of the state without emitting signals"""
+        for name, value in state.as_dict().items():
+            if name + "_sldr" in self.widgets:
+                widget = self.widgets[name + "_sldr"]
+                widget.blockSignals(True)
+                widget.setValue(value)
+                widget.blockSignals(False)
+            elif name + "_box" in self.widgets:
+                widget = self.widgets[name + "_box"]
+                widget.blockSignals(True)
+                widget.setChecked(value)
+                widget.blockSignals(False)
+
+    def _update(self, merge_key: str = None, **changes) -> None:
+        self.parent.push_state(self.parent.state.replace(**changes), merge_key)
 
     def on_rotate_btn_click(self):
         """Rotate image by 90 degrees"""
-        # TODO: use base image only
-        new_state = self.parent.states[-1]
-        new_state.rotation = new_state.rotation + 90
-        new_state.image = effects.get_rotated_image(self.parent.states[0].image, 90)
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_invert_btn_click(self):
-        """Invert image colors"""
-        self.parent.destroy()
-        if self.parent.states[-1].is_inverted:
-            return
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_inverted_image_colors(previous_image)
-        new_state.is_inverted = True
-        self.parent.states.append(new_state)
-        self.parent.show()
+        self._update(rotation=(self.parent.state.rotation + 90) % 360)
 
     def on_warp_btn_click(self):
         """Correct image using point selection"""
-        self.parent.destroy()
-        # TODO: gui dialog for point selection, calls effect
-        pass
-
-    def on_vignette_btn_click(self):
-        """Add vignette filter"""
-        self.parent.destroy()
-        if self.parent.states[-1].is_vignetted:
+        if self.parent.proxy is None:
             return
-        new_state = self.parent.states[-1]
-        new_state.image = effects.get_vignette_image(self.parent.states[0].image)
-        new_state.is_vignetted = True
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_emboss_btn_click(self):
-        """Emboss image"""
-        self.parent.destroy()
-        if self.parent.states[-1].is_embossed:
+        dialog = WarpDialog(
+            self.parent.proxy,
+            self.parent.proxy_scale,
+            self.parent.state.warp_points,
+            self,
+        )
+        if dialog.exec_() == WarpDialog.Accepted:
+            self._update(warp_points=dialog.points)
+
+    def on_toggle_click(self, name: str):
+        """Switch effect on or off"""
+        self._update(**{name: not getattr(self.parent.state, name)})
+
+    def on_slider_move(self, param: Param, value: int):
+        """Set parameter, consecutive moves are undone together"""
+        if param.odd and value % 2 == 0:
             return
-        new_state = self.parent.states[-1]
-        new_state.image = effects.get_embossed_image(self.parent.states[0].image)
-        new_state.is_embossed = True
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_sharpen_sldr_move(self, value):
-        """Sharpen"""
-        self.parent.destroy()
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_sharpen_image(previous_image, value)
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_blur_sldr_move(self, value):
-        """Set blur"""
-        # only of odd numbers
-        self.parent.destroy()
-        if value % 2 == 1:
-            new_state = self.parent.states[-1]
-            previous_image = self.parent.states[0].image
-            new_state.image = effects.get_blured_image(previous_image, value)
-            self.parent.states.append(new_state)
-            self.parent.show()
-        else:
-            pass
-
-    def on_brightness_sldr_move(self, value):
-        """Set brightness"""
-        self.parent.destroy()
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_brightness_modified_image(previous_image, value)
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_contrast_sldr_move(self, value):
-        """Set contrast"""
-        self.parent.destroy()
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_contrast_modified_image(previous_image, value)
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_noise_sldr_move(self, value):
-        """Add noise"""
-        self.parent.destroy()
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_noise(previous_image, value / 100)
-        self.parent.states.append(new_state)
-        self.parent.show()
-
-    def on_denoise_sldr_move(self, value):
-        """Denoise"""
-        self.parent.destroy()
-        new_state = self.parent.states[-1]
-        previous_image = self.parent.states[0].image
-        new_state.image = effects.get_denoised_image(previous_image, value)
-        self.parent.states.append(new_state)
-        self.parent.show()
+        self._update(param.name, **{param.name: value})
+
+    def on_check_toggle(self, name: str, checked: bool):
+        """Set switch parameter"""
+        self._update(**{name: checked})
 
     def on_reset_btn_click(self):
         """Resets all settings"""
-        self.parent.destroy()
-        self.parent.clear()
-        self.parent.show()
+        self.parent.push_state(State())
+        self.set_state(self.parent.state)
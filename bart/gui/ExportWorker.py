@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import TYPE_CHECKING, Optional
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from utils.RenderCache import RenderCache
+from utils.trace import span
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+# exports rendered and encoded at the same time
+EXPORT_WORKERS = 2
+# share of the progress taken by rendering, the rest is encoding and writing
+RENDER_SHARE = 0.7
+
+
+class ExportWorker(QObject):
+    """
+    Renders images in full resolution and saves them in background threads
+
+    Every export gets its own pipeline with a snapshot of the parameters,
+    so several exports run concurrently with each other and with preview
+    rendering while the user keeps editing. Encoding runs in OpenCV without
+    the GIL. Signals are emitted from the worker threads and delivered in the
+    thread of the receiver.
+    """
+
+    # job, finished fraction
+    progress = pyqtSignal(int, float)
+    # job, path
+    finished = pyqtSignal(int, str)
+    # job, path, error message
+    failed = pyqtSignal(int, str, str)
+
+    def __init__(
+        self,
+        parent=None,
+        cache: RenderCache = None,
+        max_workers: int = EXPORT_WORKERS,
+    ):
+        super().__init__(parent)
+        self._cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = count(1)
+        self._pending = set()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of exports not finished yet
+        """
+        return len(self._pending)
+
+    def submit(
+        self,
+        path: str,
+        image: "ndarray",
+        params: dict,
+        source_hash: str = None,
+        float_mode: bool = False,
+        quality: Optional[int] = None,
+        compression: Optional[int] = None,
+    ) -> int:
+        """
+        Starts export of the image with given pipeline parameters,
+        returns its job number
+
+        source_hash - content hash of the image, the render cache is used
+                      only when given
+        quality, compression - encoder options, see save_image
+        """
+        job = next(self._jobs)
+        self._pending.add(job)
+        self._pool.submit(
+            self._export,
+            job,
+            path,
+            image,
+            params,
+            source_hash,
+            float_mode,
+            quality,
+            compression,
+        )
+        return job
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops accepting exports, waits for the running ones by default
+        """
+        self._pool.shutdown(wait=wait)
+
+    def _export(
+        self,
+        job: int,
+        path: str,
+        image: "ndarray",
+        params: dict,
+        source_hash: Optional[str],
+        float_mode: bool,
+        quality: Optional[int],
+        compression: Optional[int],
+    ) -> None:
+        try:
+            from utils.file_utils import save_image
+            from utils.float_utils import to_uint8
+            from utils.Pipeline import Pipeline
+            from utils.tile_utils import TILE_SIZE
+
+            pipeline = Pipeline(
+                tile_size=TILE_SIZE, tile_workers=os.cpu_count(), float_mode=float_mode
+            )
+            pipeline.update(params)
+            key = None
+            result = None
+            if self._cache is not None and source_hash is not None:
+                key = self._cache.get_key(source_hash, 1.0, pipeline.get_render_key())
+                result = self._cache.get(key)
+            if result is None:
+                with span("export render", "export"):
+                    result = to_uint8(
+                        pipeline.apply(
+                            image,
+                            progress=lambda done, total: self.progress.emit(
+                                job, RENDER_SHARE * done / total
+                            ),
+                        )
+                    )
+                if key is not None:
+                    self._cache.put(key, result)
+            self.progress.emit(job, RENDER_SHARE)
+            with span("save", "export", path=path):
+                save_image(path, result, quality, compression)
+        except Exception as exc:
+            self._pending.discard(job)
+            self.failed.emit(job, path, "%s: %s" % (type(exc).__name__, exc))
+        else:
+            self._pending.discard(job)
+            self.progress.emit(job, 1.0)
+            self.finished.emit(job, path)
@@ -1,15 +1,61 @@
-from cv2 import cvtColor, COLOR_BGR2RGB
-from imutils import resize
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Tuple
+
 from gui.ControlPanel import ControlPanel
-from PyQt5.QtCore import Qt
+from gui.ExportWorker import ExportWorker
+from gui.RenderWorker import RenderWorker
+from PyQt5.QtCore import QTimer, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import QWidget, QMenuBar, QLabel, QGridLayout, QAction, QFileDialog
+from PyQt5.QtWidgets import (
+    QAction,
+    QFileDialog,
+    QGridLayout,
+    QInputDialog,
+    QLabel,
+    QMenuBar,
+    QMessageBox,
+    QWidget,
+)
+from utils.RenderCache import RenderCache, get_image_hash
+from utils.registry import get_effects, load_plugins, register_effect
 from utils.State import State
-from utils.file_utils import open_image, save_image
-from gui.Slider import Slider
+from utils.trace import TRACE_ENV, Tracer, get_tracer, set_tracer, span
+
+# OpenCV and NumPy are imported on first use so the window shows without
+# waiting for them, the render worker loads them in the background
+if TYPE_CHECKING:
+    from numpy import ndarray
+    from utils.Pipeline import Pipeline
+
+# preview size used before the image container is laid out
+PREVIEW_SIZE = (800, 800)
+
+# maximum number of undo steps
+HISTORY_SIZE = 1000
+
+IMAGE_FILTER = "Obrázky (*.png *.jpg *.jpeg *.ppm *.pgm *.npy);;Všechny soubory (*)"
+# save dialog filters and the extension used when the name has none
+EXPORT_FILTERS = {
+    "PNG (*.png)": ".png",
+    "JPEG (*.jpg *.jpeg)": ".jpg",
+    "WebP (*.webp)": ".webp",
+}
+
+
+def _load_image(path: str) -> Tuple["ndarray", str]:
+    from utils.file_utils import open_image
+
+    image = open_image(path)
+    return image, get_image_hash(image)
 
 
 class MainWindow(QWidget):
+    # full resolution decode finished, emitted from the loader thread
+    image_loaded = pyqtSignal(object)
+    # effects of installed plugins found, emitted from the loader thread
+    plugins_loaded = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.main_menu = QMenuBar()
@@ -18,10 +64,51 @@ class MainWindow(QWidget):
         self.control_panel.setEnabled(False)
         self.layout = QGridLayout()
         self.image = None
+        self.image_hash = None
+        self.proxy = None
+        self.proxy_scale = 1.0
+        self.preview = None
+        self._frame = None
+        # history of states, state_index points to the current one
         self.states = []
+        self.state_index = -1
+        self._merge_key = None
+        # renders full resolution, the preview is rendered by render_worker
+        self._pipeline = None
+        # shared by preview and full resolution renders
+        self.render_cache = RenderCache()
+        self.render_worker = RenderWorker(self, self.render_cache)
+        self.render_worker.rendered.connect(self.on_rendered)
+        self.render_worker.start()
+        # decodes full resolution while the preview is already shown
+        self._loader = ThreadPoolExecutor(max_workers=1)
+        self._image_future = None
+        self.image_loaded.connect(self.on_image_loaded)
+        self.plugins_loaded.connect(self.on_plugins_loaded)
+        # saves in the background, job -> [path, saved state, progress]
+        self.export_worker = ExportWorker(self, self.render_cache)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished.connect(self.on_exported)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self._exports = {}
+        # encoder options last used per extension
+        self._export_options = {}
+        self.status_label = QLabel()
+        # stage times of the latest preview render over the image
+        self.overlay = QLabel(self.image_container)
+        self.overlay.setStyleSheet(
+            "background: rgba(0, 0, 0, 160); color: white;"
+            "font-family: monospace; padding: 4px;"
+        )
+        self.overlay.move(8, 8)
+        self.overlay.hide()
+        self._trace_path = None
         self.setFixedWidth(1000)
         self.setFixedHeight(800)
         self.init_layout()
+        # plugins are found after the window shows, they are rarely needed
+        # right away and importlib.metadata alone slows down the start
+        QTimer.singleShot(0, self._load_plugins)
 
     def init_layout(self) -> None:
         """
@@ -43,10 +130,57 @@ class MainWindow(QWidget):
         open.triggered.connect(self.save_dialog)
         file_menu.addAction(open)
 
+        # render in full resolution
+        render = QAction("Vykreslit", self)
+        render.setShortcut("Ctrl+R")
+        render.triggered.connect(self.on_render)
+        file_menu.addAction(render)
+
+        # setup edit menu
+        edit_menu = self.main_menu.addMenu("Úpravy")
+
+        undo = QAction("Zpět", self)
+        undo.setShortcut("Ctrl+Z")
+        undo.triggered.connect(self.undo)
+        edit_menu.addAction(undo)
+
+        redo = QAction("Znovu", self)
+        redo.setShortcuts(["Ctrl+Y", "Ctrl+Shift+Z"])
+        redo.triggered.connect(self.redo)
+        edit_menu.addAction(redo)
+
+        # full resolution renders without rounding between effects
+        self.float_mode_action = QAction("Přesné zpracování", self)
+        self.float_mode_action.setCheckable(True)
+        self.float_mode_action.toggled.connect(self.on_float_mode_toggle)
+        edit_menu.addAction(self.float_mode_action)
+
+        # setup view menu
+        view_menu = self.main_menu.addMenu("Zobrazení")
+
+        self.overlay_action = QAction("Časy zpracování", self)
+        self.overlay_action.setShortcut("Ctrl+T")
+        self.overlay_action.setCheckable(True)
+        self.overlay_action.toggled.connect(self.on_overlay_toggle)
+        view_menu.addAction(self.overlay_action)
+
+        # spans of every render to a file, also enabled by the environment
+        self.trace_action = QAction("Záznam časů do souboru", self)
+        self.trace_action.setCheckable(True)
+        self.trace_action.toggled.connect(self.on_trace_toggle)
+        view_menu.addAction(self.trace_action)
+        if os.environ.get(TRACE_ENV):
+            self._trace_path = os.environ[TRACE_ENV]
+            self.trace_action.blockSignals(True)
+            self.trace_action.setChecked(True)
+            self.trace_action.blockSignals(False)
+            self._update_tracer()
+
         # set layout
         self.layout.addWidget(self.main_menu, 0, 0)
         self.layout.addWidget(self.image_container, 1, 0)
         self.layout.addWidget(self.control_panel, 1, 1)
+        self.layout.addWidget(self.status_label, 2, 0, 1, 2)
         self.layout.setColumnStretch(0, 6)
         self.layout.setRowStretch(1, 1)
         self.setLayout(self.layout)
@@ -59,62 +193,451 @@ class MainWindow(QWidget):
         Show open file dialog
         """
         file_name, _ = QFileDialog.getOpenFileName(
-            self,
-            "Otevřít obrázek",
-            "",
-            "PNG (*.png);;" "JPEG (*.jpeg);;",
+            self, "Otevřít obrázek", "", IMAGE_FILTER
         )
-        if file_name:
-            self.image = open_image(file_name)
-            self.clear()
-            self.show()
-            self.control_panel.setEnabled(True)
+        if not file_name:
+            return
+        from utils.file_utils import open_preview
+
+        try:
+            with span("open", "io", path=file_name):
+                image, scale = open_preview(file_name, *self._get_display_size())
+        except (OSError, ValueError) as exc:
+            QMessageBox.warning(self, "Otevřít obrázek", str(exc))
+            return
+        self.image, self.image_hash = None, None
+        if scale < 1.0:
+            # preview decoded at reduced size, full image follows
+            self._image_future = self._loader.submit(_load_image, file_name)
+            self._image_future.add_done_callback(self.image_loaded.emit)
+        else:
+            self._image_future = None
+            self.image, self.image_hash = image, get_image_hash(image)
+        self.update_proxy(image, scale)
+        self.clear()
+        self.show()
+        self.control_panel.setEnabled(True)
+
+    def on_image_loaded(self, future: Future) -> None:
+        """
+        Takes over full resolution image decoded in the background
+        """
+        if future is not self._image_future:
+            return
+        try:
+            self._set_image(future)
+        except (OSError, ValueError) as exc:
+            QMessageBox.warning(self, "Otevřít obrázek", str(exc))
+
+    def _load_plugins(self) -> None:
+        future = self._loader.submit(load_plugins)
+        future.add_done_callback(self.plugins_loaded.emit)
+
+    def on_plugins_loaded(self, future: Future) -> None:
+        """
+        Registers effects of plugins, adds their controls and pipeline stages
+        """
+        effects = get_effects()
+        for effect in future.result():
+            register_effect(effect)
+        added = [effect for effect in get_effects() if effect not in effects]
+        if not added:
+            return
+        self.control_panel.add_effects(added)
+        if self._pipeline is not None:
+            self._pipeline.set_stages()
+        self.render_worker.update_stages()
+        if self.states:
+            self._apply_state()
+
+    def _set_image(self, future: Future) -> None:
+        self._image_future = None
+        self.image, self.image_hash = future.result()
+        # enables the render cache for the preview
+        self.render_worker.set_source(self.proxy, self.proxy_scale, self.image_hash)
+
+    def _get_image(self) -> "ndarray":
+        """
+        Returns full resolution image, waits for the background decode
+        """
+        if self._image_future is not None:
+            self._set_image(self._image_future)
+        return self.image
 
     def save_dialog(self):
         """
-        Show save file dialog
+        Show save file dialog and export the current state in the background
         """
-        # TODO: keep only last state after save
-        file_name, _ = QFileDialog.getSaveFileName(
+        if self.proxy is None:
+            return
+        file_name, selected_filter = QFileDialog.getSaveFileName(
+            self, "Uložit obrázek", "", ";;".join(EXPORT_FILTERS)
+        )
+        if not file_name:
+            return
+        suffix = os.path.splitext(file_name)[1].lower()
+        if not suffix:
+            suffix = EXPORT_FILTERS.get(selected_filter, ".png")
+            file_name += suffix
+        options = self._get_export_options(suffix)
+        if options is None:
+            return
+        try:
+            image = self._get_image()
+        except (OSError, ValueError) as exc:
+            QMessageBox.warning(self, "Uložit obrázek", str(exc))
+            return
+        job = self.export_worker.submit(
+            file_name,
+            image,
+            self.state.get_pipeline_params(export=True),
+            self.image_hash,
+            self.float_mode_action.isChecked(),
+            **options
+        )
+        self._exports[job] = [file_name, self.state, 0.0]
+        self._show_export_status()
+
+    def _get_export_options(self, suffix: str) -> Optional[dict]:
+        """
+        Asks for quality or compression of the format, None when cancelled
+        """
+        from utils.file_utils import (
+            JPEG_QUALITY,
+            JPEG_SUFFIXES,
+            PNG_COMPRESSION,
+            WEBP_QUALITY,
+        )
+
+        if suffix == ".png":
+            name, label, default, minimum, maximum = (
+                "compression",
+                "Komprese PNG (0 rychlá – 9 nejmenší):",
+                PNG_COMPRESSION,
+                0,
+                9,
+            )
+        elif suffix in JPEG_SUFFIXES:
+            name, label, default, minimum, maximum = (
+                "quality",
+                "Kvalita JPEG (0–100):",
+                JPEG_QUALITY,
+                0,
+                100,
+            )
+        elif suffix == ".webp":
+            name, label, default, minimum, maximum = (
+                "quality",
+                "Kvalita WebP (1–100, 101 bezeztrátově):",
+                WEBP_QUALITY,
+                1,
+                101,
+            )
+        else:
+            return {}
+        value, ok = QInputDialog.getInt(
             self,
             "Uložit obrázek",
-            "",
-            "PNG (*.png);;" "JPEG (*.jpeg);;",
+            label,
+            self._export_options.get(suffix, default),
+            minimum,
+            maximum,
         )
-        save_image(file_name, self.states[-1].image)
-        self.clear()
+        if not ok:
+            return None
+        self._export_options[suffix] = value
+        return {name: value}
+
+    def on_export_progress(self, job: int, fraction: float) -> None:
+        if job in self._exports:
+            self._exports[job][2] = fraction
+            self._show_export_status()
+
+    def on_exported(self, job: int, path: str) -> None:
+        """
+        Keeps only the saved state in the history if it is still current
+        """
+        _, state, _ = self._exports.pop(job)
+        if self.states and state is self.state:
+            self.states = [self.state]
+            self.state_index = 0
+            self._merge_key = None
+        self._show_export_status("Uloženo: %s" % os.path.basename(path))
+
+    def on_export_failed(self, job: int, path: str, error: str) -> None:
+        self._exports.pop(job, None)
+        self._show_export_status("Uložení selhalo: %s" % os.path.basename(path))
+        QMessageBox.warning(self, "Uložit obrázek", "%s\n%s" % (path, error))
+
+    def _show_export_status(self, message: str = "") -> None:
+        running = [
+            "Ukládání %s %d %%" % (os.path.basename(path), round(fraction * 100))
+            for path, _, fraction in self._exports.values()
+        ]
+        self.status_label.setText(", ".join(running) or message)
+
+    def update_proxy(self, image: "ndarray" = None, scale: float = 1.0) -> None:
+        """
+        Prepare downscaled copy of the image fitting the image container
 
-    def show(self) -> None:
+        image - defaults to the full image, scale is its size relative to it
+        """
+        from cv2 import INTER_AREA, resize
+
+        if image is None:
+            image = self._get_image()
+        height, width = image.shape[:2]
+        max_width, max_height = self._get_display_size()
+        fit = min(1.0, max_width / width, max_height / height)
+        if fit < 1.0:
+            size = (max(1, round(width * fit)), max(1, round(height * fit)))
+            self.proxy = resize(image, size, interpolation=INTER_AREA)
+        else:
+            self.proxy = image
+        self.proxy_scale = scale * fit
+        self.render_worker.set_source(self.proxy, self.proxy_scale, self.image_hash)
+
+    def _get_display_size(self) -> tuple:
+        """
+        Returns size of the image container in device pixels
+        """
+        width, height = self.image_container.width(), self.image_container.height()
+        if width < 2 or height < 2:
+            return PREVIEW_SIZE
+        ratio = self.devicePixelRatioF()
+        return round(width * ratio), round(height * ratio)
+
+    @property
+    def pipeline(self) -> "Pipeline":
+        """
+        Pipeline rendering full resolution, created on first use
+        """
+        if self._pipeline is None:
+            from utils.Pipeline import Pipeline
+            from utils.tile_utils import TILE_SIZE
+
+            self._pipeline = Pipeline(
+                tile_size=TILE_SIZE,
+                tile_workers=os.cpu_count(),
+                float_mode=self.float_mode_action.isChecked(),
+            )
+        return self._pipeline
+
+    def render_full(self):
+        """
+        Render current effects in full resolution
+        """
+        from utils.float_utils import to_uint8
+
+        source = self._get_image()
+        key = self.render_cache.get_key(
+            self.image_hash, 1.0, self.pipeline.get_render_key()
+        )
+        image = self.render_cache.get(key)
+        if image is None:
+            # float mode result is quantized once for display and saving
+            image = to_uint8(self.pipeline.apply(source))
+            self.render_cache.put(key, image)
+        return image
+
+    def on_float_mode_toggle(self, checked: bool) -> None:
+        """
+        Switches preview and full resolution to float32 processing
+        """
+        self.pipeline.float_mode = checked
+        self.render_worker.set_float_mode(checked)
+        if self.states:
+            self._apply_state()
+
+    def on_render(self):
+        """
+        Show full resolution render
+        """
+        if self.proxy is None:
+            return
+        try:
+            self.show(self.render_full())
+        except (OSError, ValueError) as exc:
+            QMessageBox.warning(self, "Vykreslit", str(exc))
+
+    def show(self, image: "ndarray" = None) -> None:
         """
         Update image container
+
+        The image is downscaled once to fit the container, BGR data is
+        passed to Qt without color conversion.
         """
-        if len(self.states):
-            image = resize(self.states[-1].image, width=800)
-            frame = cvtColor(image, COLOR_BGR2RGB)
+        if image is None:
+            image = self.preview
+        if image is None:
+            return
+        from cv2 import INTER_AREA, resize
+        from numpy import ascontiguousarray
+
+        height, width = image.shape[:2]
+        max_width, max_height = self._get_display_size()
+        scale = min(1.0, max_width / width, max_height / height)
+        if scale < 1.0:
+            width, height = max(1, round(width * scale)), max(1, round(height * scale))
+            with span("resize", "display"):
+                image = resize(image, (width, height), interpolation=INTER_AREA)
+
+        with span("pixmap", "display"):
+            # QImage does not own the buffer, keep it alive with the window
+            self._frame = ascontiguousarray(image)
             image = QImage(
-                frame,
-                frame.shape[1],
-                frame.shape[0],
-                frame.strides[0],
-                QImage.Format_RGB888,
+                self._frame,
+                width,
+                height,
+                self._frame.strides[0],
+                QImage.Format_BGR888
+                if self._frame.ndim == 3
+                else QImage.Format_Grayscale8,
             )
-            q = QPixmap.fromImage(image)
-            q.scaled(64, 64, Qt.KeepAspectRatio)
-            self.image_container.setPixmap(q)
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(self.devicePixelRatioF())
+        with span("set pixmap", "display"):
+            self.image_container.setPixmap(pixmap)
 
-    def clear(self):
+    @property
+    def state(self) -> State:
+        return self.states[self.state_index]
+
+    def push_state(self, state: State, merge_key: str = None) -> None:
         """
-        Retrieve default state
+        Applies state and adds it to the history
+
+        Consecutive changes with the same merge_key (e.g. dragging one
+        slider) replace each other and are undone in one step.
         """
-        self.states.clear()
-        self.states.append(State(self.image))
-        for w in self.control_panel.widgets.values():
-            if isinstance(w, Slider):
-                w.reset()
+        if state == self.state:
+            return
+        del self.states[self.state_index + 1 :]
+        if merge_key is not None and merge_key == self._merge_key:
+            self.states[-1] = state
+        else:
+            self.states.append(state)
+            del self.states[:-HISTORY_SIZE]
+        self.state_index = len(self.states) - 1
+        self._merge_key = merge_key
+        self._apply_state()
+
+    def undo(self) -> None:
+        if self.state_index > 0:
+            self.state_index -= 1
+            self._merge_key = None
+            self._apply_state()
+            self.control_panel.set_state(self.state)
 
-    def destroy(self):
+    def redo(self) -> None:
+        if self.state_index < len(self.states) - 1:
+            self.state_index += 1
+            self._merge_key = None
+            self._apply_state()
+            self.control_panel.set_state(self.state)
+
+    def _apply_state(self) -> None:
+        """
+        Renders current state in the background
         """
-        Destroy previous filter
+        # full resolution renders are exported, the preview may use fast modes
+        self.pipeline.update(self.state.get_pipeline_params(export=True))
+        self.render_worker.submit(self.state.get_pipeline_params())
+
+    def on_rendered(self, generation: int, image) -> None:
         """
-        self.states.clear()
-        self.states.append(State(self.image))
+        Show image delivered by the render worker
+        """
+        if generation != self.render_worker.generation:
+            return
+        self.preview = image
+        self.show()
+        self._update_overlay()
+
+    def on_overlay_toggle(self, checked: bool) -> None:
+        self.overlay.setVisible(checked)
+        self._update_tracer()
+        if checked:
+            self.overlay.setText("Časy se zobrazí po vykreslení")
+            self.overlay.adjustSize()
+
+    def on_trace_toggle(self, checked: bool) -> None:
+        self._trace_path = None
+        if checked:
+            path, _ = QFileDialog.getSaveFileName(
+                self, "Záznam časů", "trace.jsonl", "JSON Lines (*.jsonl)"
+            )
+            if not path:
+                self.trace_action.blockSignals(True)
+                self.trace_action.setChecked(False)
+                self.trace_action.blockSignals(False)
+                return
+            self._trace_path = path
+        self._update_tracer()
+
+    def _update_tracer(self) -> None:
+        """
+        Installs tracer needed by the overlay and the trace file, if any
+        """
+        tracer = get_tracer()
+        if self._trace_path:
+            if tracer is None or tracer.path != self._trace_path:
+                try:
+                    set_tracer(Tracer(self._trace_path))
+                except OSError as exc:
+                    QMessageBox.warning(self, "Záznam časů", str(exc))
+                    self._trace_path = None
+                    self.trace_action.setChecked(False)
+        elif self.overlay_action.isChecked():
+            if tracer is None or tracer.path is not None:
+                set_tracer(Tracer())
+        else:
+            set_tracer(None)
+
+    def _update_overlay(self) -> None:
+        """
+        Shows stage times of the latest preview render and its display
+        """
+        tracer = get_tracer()
+        if tracer is None or not self.overlay.isVisible():
+            return
+        spans = tracer.get_latest(self.render_worker.thread_id)
+        renders = [span for span in spans if span[1] == "render"]
+        if not renders:
+            return
+        render = renders[-1]
+        lines = [
+            "%-22s %7.1f ms" % (name, duration * 1000)
+            for name, category, start, duration in spans
+            if category == "stage" and start >= render[2]
+        ]
+        lines.append("%-22s %7.1f ms" % (render[0], render[3] * 1000))
+        display = [span for span in tracer.get_latest() if span[1] == "display"]
+        for name, _, _, duration in display:
+            lines.append("%-22s %7.1f ms" % (name, duration * 1000))
+        total = render[3] + sum(span[3] for span in display)
+        lines.append(
+            "%-22s %7.1f ms %5.1f fps"
+            % ("celkem", total * 1000, 1 / total if total else 0)
+        )
+        self.overlay.setText("\n".join(lines))
+        self.overlay.adjustSize()
+
+    def clear(self):
+        """
+        Retrieve default state
+        """
+        self.states = [State()]
+        self.state_index = 0
+        self._merge_key = None
+        self.preview = self.proxy
+        self._apply_state()
+        self.control_panel.set_state(self.state)
+
+    def closeEvent(self, event) -> None:
+        self._loader.shutdown(wait=False)
+        # running exports are finished, files are replaced only when complete
+        self.export_worker.shutdown()
+        set_tracer(None)
+        self.render_worker.stop()
+        super().closeEvent(event)
@@ -0,0 +1,139 @@
+from threading import Condition, get_ident
+from typing import TYPE_CHECKING
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from utils.RenderCache import RenderCache
+from utils.trace import span
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+
+class RenderWorker(QThread):
+    """
+    Background thread rendering the effect pipeline
+
+    Only the latest submitted parameter set is kept, so bursts of slider
+    events coalesce into one render. Renders outdated by a newer request are
+    cancelled between stages and never delivered. Finished renders are kept
+    in the optional render cache.
+    """
+
+    rendered = pyqtSignal(int, object)
+
+    def __init__(self, parent=None, cache: RenderCache = None):
+        super().__init__(parent)
+        # created by the thread, which also loads OpenCV in the background
+        self._pipeline = None
+        self._cache = cache
+        self._condition = Condition()
+        self._source = None
+        self._source_hash = None
+        self._params = None
+        self._generation = 0
+        self._is_running = True
+        # effects were registered since the pipeline was created
+        self._stages_changed = False
+        # same arithmetic as the full resolution pipeline, see set_float_mode
+        self._float_mode = False
+        # identifies spans of this thread in the trace
+        self.thread_id = None
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def set_source(
+        self, image: "ndarray", scale: float = 1.0, source_hash: str = None
+    ) -> None:
+        """
+        Sets image rendered by following requests
+
+        source_hash - content hash of the full resolution image, the render
+                      cache is used only when given
+        """
+        with self._condition:
+            self._source = (image, scale, source_hash)
+
+    def update_stages(self) -> None:
+        """
+        Rebuilds the pipeline from the registered effects before next render
+        """
+        with self._condition:
+            self._stages_changed = True
+
+    def set_float_mode(self, float_mode: bool) -> None:
+        """
+        Renders following requests in float32, the result is quantized once
+        """
+        with self._condition:
+            self._float_mode = float_mode
+
+    def submit(self, params: dict) -> int:
+        """
+        Requests render with given pipeline parameters, returns its generation
+        """
+        with self._condition:
+            self._generation += 1
+            self._params = params
+            self._condition.notify()
+            return self._generation
+
+    def stop(self) -> None:
+        with self._condition:
+            self._is_running = False
+            self._condition.notify()
+        self.wait()
+
+    def _is_outdated(self, generation: int) -> bool:
+        return generation != self._generation or not self._is_running
+
+    def run(self) -> None:
+        from utils.float_utils import to_uint8
+        from utils.Pipeline import Pipeline
+
+        self.thread_id = get_ident()
+        self._pipeline = Pipeline()
+        while True:
+            with self._condition:
+                while self._params is None and self._is_running:
+                    self._condition.wait()
+                if not self._is_running:
+                    return
+                generation = self._generation
+                source, self._source = self._source, None
+                params, self._params = self._params, None
+                stages_changed, self._stages_changed = self._stages_changed, False
+                float_mode = self._float_mode
+
+            if stages_changed:
+                self._pipeline.set_stages()
+            if source is not None:
+                image, scale, self._source_hash = source
+                self._pipeline.set_source(image, scale)
+            # changing the mode converts the source and drops cached outputs
+            self._pipeline.float_mode = float_mode
+            self._pipeline.update(params)
+
+            key = None
+            if self._cache is not None and self._source_hash is not None:
+                key = self._cache.get_key(
+                    self._source_hash,
+                    self._pipeline.scale,
+                    self._pipeline.get_render_key(),
+                )
+                with span("cache", "render"):
+                    image = self._cache.get(key)
+                if image is not None:
+                    self.rendered.emit(generation, image)
+                    continue
+
+            with span("render", "render"):
+                image = self._pipeline.render(lambda: self._is_outdated(generation))
+            if image is None:
+                continue
+            image = to_uint8(image)
+            if key is not None:
+                self._cache.put(key, image)
+            if not self._is_outdated(generation):
+                self.rendered.emit(generation, image)
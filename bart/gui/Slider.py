@@ -1,18 +1,26 @@
-from PyQt5.QtWidgets import *
+from PyQt5.QtWidgets import QSlider
 
 
 class Slider(QSlider):
     """Custom QSlider"""
 
     def __init__(
-        self, position, parent, min_value: int, max_value: int, is_odd: bool = False
+        self,
+        position,
+        parent,
+        min_value: int,
+        max_value: int,
+        is_odd: bool = False,
+        default_value: int = None,
     ):
         super(QSlider, self).__init__(parent)
         self._is_odd = is_odd
+        self._default_value = min_value if default_value is None else default_value
 
         self.setMinimum(min_value)
         self.setMaximum(max_value)
         self.setOrientation(position)
+        self.setValue(self._default_value)
 
     def reset(self):
-        self.setValue(self.minimum())
+        self.setValue(self._default_value)
@@ -0,0 +1,191 @@
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from PyQt5.QtCore import QPoint, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap, QPolygon
+from PyQt5.QtWidgets import (
+    QDialog,
+    QDialogButtonBox,
+    QLabel,
+    QPushButton,
+    QVBoxLayout,
+)
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+# largest shown image in pixels
+DIALOG_SIZE = (900, 700)
+# radius of the point markers
+MARKER_RADIUS = 6
+CORNER_NAMES = ("levý horní", "pravý horní", "levý dolní", "pravý dolní")
+
+
+class PointSelector(QLabel):
+    """Image with up to four points placed by clicking and moved by dragging"""
+
+    changed = pyqtSignal()
+
+    def __init__(self, pixmap: QPixmap, points: List[Tuple[int, int]], parent=None):
+        super().__init__(parent)
+        self._pixmap = pixmap
+        self._dragged = None
+        self.points = points
+        self.setFixedSize(pixmap.size())
+        self._redraw()
+
+    def mousePressEvent(self, event) -> None:
+        position = self._clamp(event.pos())
+        if len(self.points) < 4:
+            self.points.append(position)
+            self._dragged = len(self.points) - 1
+        else:
+            # move the nearest corner
+            self._dragged = min(
+                range(4),
+                key=lambda i: (self.points[i][0] - position[0]) ** 2
+                + (self.points[i][1] - position[1]) ** 2,
+            )
+            self.points[self._dragged] = position
+        self._changed()
+
+    def mouseMoveEvent(self, event) -> None:
+        if self._dragged is not None:
+            self.points[self._dragged] = self._clamp(event.pos())
+            self._changed()
+
+    def mouseReleaseEvent(self, event) -> None:
+        self._dragged = None
+
+    def clear(self) -> None:
+        self.points = []
+        self._dragged = None
+        self._changed()
+
+    def _clamp(self, position: QPoint) -> Tuple[int, int]:
+        return (
+            min(max(position.x(), 0), self.width() - 1),
+            min(max(position.y(), 0), self.height() - 1),
+        )
+
+    def _changed(self) -> None:
+        self._redraw()
+        self.changed.emit()
+
+    def _redraw(self) -> None:
+        pixmap = self._pixmap.copy()
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor(255, 200, 0), 2))
+        if len(self.points) == 4:
+            # corners are ordered by rows, the outline goes around
+            painter.drawPolygon(
+                QPolygon([QPoint(*self.points[i]) for i in (0, 1, 3, 2)])
+            )
+        for i, (x, y) in enumerate(self.points):
+            painter.drawEllipse(QPoint(x, y), MARKER_RADIUS, MARKER_RADIUS)
+            painter.drawText(x + MARKER_RADIUS + 2, y - MARKER_RADIUS, str(i + 1))
+        painter.end()
+        self.setPixmap(pixmap)
+
+
+class WarpDialog(QDialog):
+    """
+    Selection of the corners stretched to the whole image by perspective
+    correction
+
+    The image is shown downscaled, points are returned in coordinates of
+    the full resolution image.
+    """
+
+    def __init__(
+        self,
+        image: "ndarray",
+        scale: float = 1.0,
+        points: Optional[tuple] = None,
+        parent=None,
+    ):
+        """
+        image - preview of the image without geometry changes
+        scale - size of the preview relative to the full resolution image
+        points - current corners in full resolution coordinates
+        """
+        super().__init__(parent)
+        from numpy import ascontiguousarray
+
+        self.setWindowTitle("Korekce perspektivy")
+        height, width = image.shape[:2]
+        fit = min(1.0, DIALOG_SIZE[0] / width, DIALOG_SIZE[1] / height)
+        # QImage does not own the buffer, keep it alive with the dialog
+        self._frame = ascontiguousarray(image)
+        pixmap = QPixmap.fromImage(
+            QImage(
+                self._frame,
+                width,
+                height,
+                self._frame.strides[0],
+                QImage.Format_BGR888
+                if self._frame.ndim == 3
+                else QImage.Format_Grayscale8,
+            )
+        )
+        if fit < 1.0:
+            pixmap = pixmap.scaled(
+                round(width * fit),
+                round(height * fit),
+                Qt.KeepAspectRatio,
+                Qt.SmoothTransformation,
+            )
+        # full resolution coordinates to shown pixels
+        self._factor = scale * pixmap.width() / width
+        self._is_removed = False
+
+        self.hint = QLabel()
+        self.selector = PointSelector(
+            pixmap,
+            [
+                (round(x * self._factor), round(y * self._factor))
+                for x, y in points or ()
+            ],
+            self,
+        )
+        self.selector.changed.connect(self._update_buttons)
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        clear = QPushButton("Vybrat znovu")
+        clear.clicked.connect(self.selector.clear)
+        self.buttons.addButton(clear, QDialogButtonBox.ResetRole)
+        remove = QPushButton("Zrušit korekci")
+        remove.clicked.connect(self.on_remove)
+        self.buttons.addButton(remove, QDialogButtonBox.DestructiveRole)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.hint)
+        layout.addWidget(self.selector)
+        layout.addWidget(self.buttons)
+        self.setLayout(layout)
+        self._update_buttons()
+
+    @property
+    def points(self) -> Optional[tuple]:
+        """
+        Selected corners in full resolution coordinates, None when removed
+        """
+        if self._is_removed or len(self.selector.points) < 4:
+            return None
+        return tuple(
+            (round(x / self._factor, 1), round(y / self._factor, 1))
+            for x, y in self.selector.points
+        )
+
+    def on_remove(self) -> None:
+        self._is_removed = True
+        self.accept()
+
+    def _update_buttons(self) -> None:
+        count = len(self.selector.points)
+        if count < 4:
+            self.hint.setText("Klikněte na %s roh" % CORNER_NAMES[count])
+        else:
+            self.hint.setText("Rohy lze posunout tažením")
+        self.buttons.button(QDialogButtonBox.Ok).setEnabled(count == 4)
@@ -0,0 +1,110 @@
+"""
+Cold start time of the GUI and profile of the imports it needs
+
+Every run starts a fresh interpreter and measures the time until the main
+window has processed its first events. Exits with 1 when the median time
+exceeds the budget, so it can guard startup time in CI. The profile also
+lists utils.Pipeline, which the render worker imports in the background.
+
+Usage (from the bart directory):
+    python startup.py [--budget 1.0] [--repeat 5] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+# seconds from interpreter start to the first shown window
+STARTUP_BUDGET = 1.0
+
+STARTUP_CODE = """
+from PyQt5.QtWidgets import QApplication
+from gui.MainWindow import MainWindow
+
+app = QApplication([])
+window = MainWindow()
+app.processEvents()
+print("ready", flush=True)
+window.render_worker.stop()
+"""
+
+
+def measure(importtime: bool = False) -> Tuple[float, str]:
+    """
+    Returns seconds to the first window and -X importtime output
+    """
+    env = dict(os.environ)
+    if "DISPLAY" not in env and "WAYLAND_DISPLAY" not in env:
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command + ["-c", STARTUP_CODE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    line = process.stdout.readline()
+    elapsed = time.perf_counter() - start
+    _, errors = process.communicate()
+    if line.strip() != "ready":
+        raise RuntimeError("GUI did not start:\n%s" % errors)
+    return elapsed, errors
+
+
+def get_import_profile(output: str) -> List[Tuple[float, float, str]]:
+    """
+    Returns (cumulative ms, self ms, module) of top level imports
+    """
+    profile = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        # nested imports are indented below the module importing them
+        if name.startswith("  "):
+            continue
+        profile.append((int(cumulative) / 1000, int(own) / 1000, name.strip()))
+    return sorted(profile, reverse=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure GUI cold start")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=STARTUP_BUDGET,
+        help="maximum median seconds to the first window",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--top", type=int, default=15, help="number of imports in the profile"
+    )
+    args = parser.parse_args(argv)
+
+    _, output = measure(importtime=True)
+    print("%10s %10s  %s" % ("cumul. ms", "self ms", "top level import"))
+    for cumulative, own, name in get_import_profile(output)[: args.top]:
+        print("%10.1f %10.1f  %s" % (cumulative, own, name))
+
+    times = [measure()[0] for _ in range(args.repeat)]
+    median = statistics.median(times)
+    print(
+        "Startup %.3f s median, %.3f s min of %d runs, budget %.3f s"
+        % (median, min(times), len(times), args.budget)
+    )
+    if median > args.budget:
+        print("Startup budget exceeded")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
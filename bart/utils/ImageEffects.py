@@ -1,21 +1,28 @@
-from noise import pnoise2
+from functools import lru_cache
+from typing import Optional, Sequence
+
 from cv2 import (
+    CV_8U,
+    CV_32F,
     COLOR_BGR2GRAY,
-    COLOR_BGR2LAB,
-    COLOR_LAB2BGR,
-    GaussianBlur,
+    COLOR_BGR2YCrCb,
+    COLOR_GRAY2BGR,
+    COLOR_YCrCb2BGR,
     addWeighted,
+    bitwise_and,
     bitwise_not,
     convertScaleAbs,
-    createCLAHE,
     cvtColor,
-    filter2D,
+    extractChannel,
+    fillConvexPoly,
     getPerspectiveTransform,
     getRotationMatrix2D,
     imread,
     imshow,
+    insertChannel,
     merge,
-    split,
+    multiply,
+    rotate,
     waitKey,
     warpAffine,
     warpPerspective,
@@ -23,18 +30,46 @@ from cv2 import (
     getGaussianKernel,
 )
 from numpy import (
+    absolute,
     add,
-    array,
+    clip,
+    empty_like,
     float32,
+    int32,
     ndarray,
     interp,
-    full,
-    clip,
+    rint,
+    subtract,
     uint8,
-    linalg,
-    copy,
     zeros,
 )
+from utils.contrast_utils import GRID_SIZE, get_clahe
+from utils.convolution_utils import (
+    EMBOSS_KERNEL,
+    convolve,
+    convolve_separable,
+    get_gaussian_kernel,
+    get_gaussian_size,
+    get_sharpen_kernel,
+    guided_filter,
+)
+from utils.float_utils import is_float
+from utils.geometry_utils import TURNS, Points, get_frame, get_geometry, is_affine
+from utils.lut_utils import apply_lut, compose_luts, get_offset_lut, get_rgb_lut
+from utils.perlin_utils import perlin_noise, tile, tileable_perlin_noise
+
+
+# number of cached vignette masks, one per image size and degree
+VIGNETTE_CACHE_SIZE = 2
+# rows of the image multiplied by the vignette mask at once
+VIGNETTE_BAND_ROWS = 64
+# fractional bits of the corrected image corners when masking its surroundings
+FRAME_SHIFT = 4
+# edge of the tileable noise atlas and number of cached atlases
+NOISE_ATLAS_SIZE = 1024
+NOISE_CACHE_SIZE = 4
+# drift of the grain in pixels per frame
+GRAIN_SPEED = 16
 
 
 class ImageEffects:
@@ -63,94 +98,139 @@ class ImageEffects:
         return rotated_mat
 
     @staticmethod
-    def get_sharpen_image(image: ndarray, degree: float = 1) -> ndarray:
+    def get_sharpen_image(
+        image: ndarray, degree: float = 1, radius: float = 0
+    ) -> ndarray:
         """
         Sharpens the image
 
         degree <0, 5>
+        radius - sigma of unsharp mask, 0 uses 3x3 sharpening kernel
         """
-        filter = array(
-            [[0, -degree, 0], [-degree, 1 + 4 * degree, -degree], [0, -degree, 0]]
-        )
-        return filter2D(image, -1, filter)
+        if radius > 0:
+            kernel = get_gaussian_kernel(get_gaussian_size(radius), radius)
+            blured = convolve_separable(image, kernel, kernel)
+            return addWeighted(image, 1 + degree, blured, -degree, 0)
+        return convolve(image, get_sharpen_kernel(degree))
 
     @staticmethod
     def get_blured_image(image: ndarray, degree: float = 1) -> ndarray:
         """
         Adds gaussian blur to the image
 
-        degree {1, 3, 5, 7 ... max 15}
+        degree {1, 3, 5, 7 ... max 99}
         """
-        return GaussianBlur(image, (degree, degree), 0)
+        kernel = get_gaussian_kernel(degree)
+        return convolve_separable(image, kernel, kernel)
 
     @staticmethod
-    def get_inverted_image_colors(image: ndarray) -> ndarray:
+    def get_inverted_image_colors(image: ndarray, in_place: bool = False) -> ndarray:
         """
         Inverts image colors
+
+        in_place - write the result into the input image
         """
-        return bitwise_not(image)
+        if is_float(image):
+            return subtract(255, image, out=image if in_place else None)
+        return bitwise_not(image, dst=image if in_place else None)
 
     @staticmethod
-    def get_embossed_image(image: ndarray, degree: float = 128) -> ndarray:
+    def get_embossed_image(
+        image: ndarray, degree: float = 128, lut: ndarray = None
+    ) -> ndarray:
         """
         Applies grayscale and detects edges
 
         degree <0, 128>
+        lut - lookup table applied in the same pass as the offset
         """
         image_grayscaled = cvtColor(image, COLOR_BGR2GRAY)
-        kernel = array([[0, -1, -1], [1, 0, -1], [1, 1, 0]])
-        image_embossed = filter2D(image_grayscaled, -1, kernel)
-        return add(image_embossed, degree)
+        image_embossed = convolve(image_grayscaled, EMBOSS_KERNEL)
+        if is_float(image_embossed):
+            # same saturation and wrap around as the uint8 version
+            clip(image_embossed, 0, 255, out=image_embossed)
+            image_embossed += degree
+            image_embossed[image_embossed >= 256] -= 256
+            return image_embossed
+        if lut is None:
+            return add(image_embossed, degree)
+        offset = get_offset_lut(degree, saturate=False)
+        return apply_lut(image_embossed, compose_luts(offset, lut))
 
     @staticmethod
-    def get_rgb_modified_image(image: ndarray, color: array) -> ndarray:
+    def get_rgb_modified_image(
+        image: ndarray, color: Sequence[int], in_place: bool = False
+    ) -> ndarray:
         """
         Applies R-red, G-green or B-blue color to the image
 
-        color <0, 255>
+        color (red, green, blue) <-255, 255>
+        in_place - write the result into float32 input image
         """
-
-        adjustments = color
-
-        adjustments = clip(adjustments, -255, 255)
-
-        max_val = full(image.shape, 255)
-        positive_adjust = adjustments > 0
-        adjusted_image = where(
-            positive_adjust, minimum(image + adjustments, max_val), image + adjustments
-        )
-
-        print(adjusted_image.dtype)
-        adjusted_image = adjusted_image.astype(uint8)
-        print(adjusted_image.dtype)
-
-        return adjusted_image
+        if is_float(image):
+            if image.ndim == 2:
+                image, in_place = cvtColor(image, COLOR_GRAY2BGR), True
+            offsets = clip(color, -255, 255)[::-1].astype(float32)
+            return add(image, offsets, out=image if in_place else None)
+        return apply_lut(image, get_rgb_lut(color))
 
     @staticmethod
-    def get_brightness_modified_image(image: ndarray, degree: float = 1) -> ndarray:
+    def get_brightness_modified_image(
+        image: ndarray, degree: float = 1, in_place: bool = False
+    ) -> ndarray:
         """
         Change exposure of the image
 
         degree <0, 200>
+        in_place - write the result into float32 input image
         """
+        if is_float(image):
+            result = add(image, degree, out=image if in_place else None)
+            return absolute(result, out=result)
         return convertScaleAbs(image, alpha=1, beta=degree)
 
     @staticmethod
-    def get_contrast_modified_image(image: ndarray, degree: float = 1) -> ndarray:
+    def get_contrast_modified_image(
+        image: ndarray, degree: float = 1, grid: int = GRID_SIZE, in_place: bool = False
+    ) -> ndarray:
         """
         Applies contrast to the image
 
+        Equalizes luminance with CLAHE, color difference channels are kept.
+
         degree <0, 2>
+        grid - number of histogram tiles along each axis
+        in_place - write the result into the input image
         """
-        lab = cvtColor(image, COLOR_BGR2LAB)
-        l_channel, a, b = split(lab)
-
-        clahe = createCLAHE(clipLimit=degree, tileGridSize=(8, 8))
-        cl = clahe.apply(l_channel)
-
-        limg = merge((cl, a, b))
-        adjusted_image = cvtColor(limg, COLOR_LAB2BGR)
+        if is_float(image):
+            return ImageEffects._get_float_contrast_modified_image(
+                image, degree, grid, in_place
+            )
+        # single converted buffer, luminance is equalized in place
+        ycrcb = cvtColor(image, COLOR_BGR2YCrCb)
+        luminance = extractChannel(ycrcb, 0)
+        get_clahe(degree, grid).apply(luminance, dst=luminance)
+        insertChannel(luminance, ycrcb, 0)
+        return cvtColor(ycrcb, COLOR_YCrCb2BGR, dst=image if in_place else ycrcb)
 
+    @staticmethod
+    def _get_float_contrast_modified_image(
+        image: ndarray, degree: float, grid: int, in_place: bool
+    ) -> ndarray:
+        # CLAHE works on 8 bit luminance, only its correction is added to
+        # the float luminance so the detail below 8 bit is kept
+        ycrcb = cvtColor(image * (1 / 255), COLOR_BGR2YCrCb)
+        luminance = extractChannel(ycrcb, 0)
+        luminance_8bit = clip(rint(luminance * 255), 0, 255).astype(uint8)
+
+        equalized = get_clahe(degree, grid).apply(luminance_8bit)
+        luminance += (equalized.astype(float32) - luminance_8bit) * (1 / 255)
+        insertChannel(luminance, ycrcb, 0)
+
+        adjusted_image = cvtColor(
+            ycrcb, COLOR_YCrCb2BGR, dst=image if in_place else ycrcb
+        )
+        adjusted_image *= 255
         return adjusted_image
 
     @staticmethod
@@ -171,6 +251,37 @@ class ImageEffects:
 
         return warpPerspective(image, perspective_transform, (width, height))
 
+    @staticmethod
+    def get_transformed_image(
+        image: ndarray, angle: float = 0, points: Optional[Points] = None
+    ) -> ndarray:
+        """
+        Corrects perspective and rotates the image resampling it at most once
+
+        Quarter turns are exact, perspective correction (see get_warped_image)
+        and the rest of the rotation (see get_rotated_image) are composed
+        into one homography. Pixels outside of the corrected image are black.
+
+        angle - counterclockwise in degrees
+        points - corners of the quadrilateral stretched to the whole image
+        """
+        height, width = image.shape[:2]
+        turns, matrix, size = get_geometry(width, height, angle, points)
+        if turns:
+            image = rotate(image, TURNS[turns])
+        if matrix is None:
+            return image
+        if is_affine(matrix):
+            return warpAffine(image, matrix[:2], size)
+        image = warpPerspective(image, matrix, size)
+        frame = get_frame(width, height, angle, points)
+        if frame is not None:
+            mask = zeros(image.shape[:2], uint8)
+            corners = rint(frame * (1 << FRAME_SHIFT)).astype(int32)
+            fillConvexPoly(mask, corners, 255, shift=FRAME_SHIFT)
+            image = bitwise_and(image, image, mask=mask)
+        return image
+
     @staticmethod
     def get_noise(
         image: ndarray,
@@ -178,6 +289,7 @@ class ImageEffects:
         octaves: float = 1,
         persistence: float = 0.5,
         lacunarity: float = 2.0,
+        seed: int = 0,
     ) -> ndarray:
         """
         Applies perlin noise to the image
@@ -188,58 +300,170 @@ class ImageEffects:
         height, width = image_grayscaled.shape
 
         noise = ImageEffects.get_perlin_noise(
-            height, width, degree, octaves, persistence, lacunarity
+            height, width, degree, octaves, persistence, lacunarity, seed
         )
-        noise = interp(noise, (noise.min(), noise.max()), (0, 255)).astype(uint8)
+        noise = interp(noise, (noise.min(), noise.max()), (0, 255))
+        noise = noise.astype(image_grayscaled.dtype)
 
         return addWeighted(image_grayscaled, 0.8, noise, 0.2, 0)
 
+    @staticmethod
+    def get_grain_image(
+        image: ndarray,
+        degree: float = 0.1,
+        amount: float = 0.2,
+        frame: int = 0,
+        speed: float = GRAIN_SPEED,
+        color: bool = True,
+        octaves: float = 1,
+        persistence: float = 0.5,
+        lacunarity: float = 2.0,
+        seed: int = 0,
+        in_place: bool = False,
+    ) -> ndarray:
+        """
+        Applies perlin noise grain sampled from a cached tileable atlas
+
+        degree <0, 1> - scale of the noise like get_noise
+        amount <0, 1> - weight of the noise
+        frame - frame of a sequence, the grain drifts by speed pixels per frame
+        color - independent noise per channel, otherwise the same in all
+        in_place - write the result into the input image
+        """
+        channels = image.shape[2] if image.ndim == 3 else 1
+        atlas = ImageEffects.get_noise_atlas(
+            degree, octaves, persistence, lacunarity, seed, channels, color
+        )
+        top, left = round(frame * speed * 0.618), round(frame * speed)
+        noise = tile(atlas, *image.shape[:2], top, left, empty_like(image))
+        return addWeighted(
+            image, 1 - amount, noise, amount, 0, dst=image if in_place else None
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=NOISE_CACHE_SIZE)
+    def get_noise_atlas(
+        degree: float,
+        octaves: float = 1,
+        persistence: float = 0.5,
+        lacunarity: float = 2.0,
+        seed: int = 0,
+        channels: int = 1,
+        color: bool = True,
+    ) -> ndarray:
+        """
+        Returns read-only uint8 tileable noise of NOISE_ATLAS_SIZE squared,
+        color atlas uses a different seed for every channel
+        """
+        layers = []
+        for channel in range(channels if color else 1):
+            noise = tileable_perlin_noise(
+                NOISE_ATLAS_SIZE,
+                degree,
+                octaves,
+                persistence,
+                lacunarity,
+                seed + channel,
+            )
+            noise = interp(noise, (noise.min(), noise.max()), (0, 255))
+            layers.append(noise.astype(uint8))
+        if channels > 1:
+            atlas = merge(layers if color else layers * channels)
+        else:
+            atlas = layers[0]
+        atlas.flags.writeable = False
+        return atlas
+
     @staticmethod
     def get_denoised_image(
-        image: ndarray, degree: float = 10, sigmaColor: int = 30, sigmaSpace: int = 20
+        image: ndarray,
+        degree: float = 10,
+        sigmaColor: int = 30,
+        sigmaSpace: int = 20,
+        mode: str = "exact",
     ) -> ndarray:
         """
         Applies noise reduction to the image using bilateral filter
 
         degree <0, 50>
+        mode - "exact" bilateral filter or "fast" guided filter approximation
+               with the same radius, which keeps interactive use responsive
         """
+        if mode == "fast":
+            radius = degree // 2 if degree > 0 else round(sigmaSpace * 1.5)
+            return guided_filter(image, max(1, radius), sigmaColor**2)
         return bilateralFilter(image, degree, sigmaColor, sigmaSpace)
 
     @staticmethod
-    def get_vignette_image(image: ndarray, degree: float = 300) -> ndarray:
+    def get_vignette_image(
+        image: ndarray, degree: float = 300, in_place: bool = False
+    ) -> ndarray:
         """
         Applies vignette effect to the image
 
         degree = 150 (default)
+        in_place - write the result into the input image
         """
         rows, cols = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        mask = ImageEffects.get_vignette_mask(rows, cols, degree)
+
+        dtype = CV_32F if is_float(image) else CV_8U
+        result = image if in_place else empty_like(image)
+        # the single channel mask is expanded to the image channels by bands
+        for top in range(0, rows, VIGNETTE_BAND_ROWS):
+            band = slice(top, top + VIGNETTE_BAND_ROWS)
+            band_mask = mask[band] if channels == 1 else merge([mask[band]] * channels)
+            multiply(image[band], band_mask, dst=result[band], dtype=dtype)
+        return result
 
-        gaussian_kernel_x = getGaussianKernel(cols, degree)
-        gaussian_kernel_y = getGaussianKernel(rows, degree)
-
-        resultant_kernel = gaussian_kernel_y * gaussian_kernel_x.T
-
-        mask = 255 * resultant_kernel / linalg.norm(resultant_kernel)
-
-        adjusted_image = copy(image)
-
-        for i in range(3):
-            adjusted_image[:, :, i] = adjusted_image[:, :, i] * mask
+    @staticmethod
+    @lru_cache(maxsize=VIGNETTE_CACHE_SIZE)
+    def get_vignette_mask(rows: int, cols: int, degree: float) -> ndarray:
+        """
+        Returns read-only rows x cols float32 vignette mask normalized to 1
+        in the center
+        """
+        gaussian_kernel_x = getGaussianKernel(cols, degree, ktype=CV_32F)
+        gaussian_kernel_y = getGaussianKernel(rows, degree, ktype=CV_32F)
 
-        return adjusted_image
+        mask = gaussian_kernel_y * gaussian_kernel_x.T
+        mask /= mask.max()
+        mask.flags.writeable = False
+        return mask
 
     @staticmethod
     def get_perlin_noise(
-        height, width, scale=0.1, octaves=1, persistence=0.5, lacunarity=2.0
+        height,
+        width,
+        scale=0.1,
+        octaves=1,
+        persistence=0.5,
+        lacunarity=2.0,
+        seed=0,
+        vectorized=True,
     ):
+        """
+        Generates perlin noise field of given size
+
+        vectorized=False falls back to the per-pixel pnoise2 reference loop
+        """
+        if vectorized:
+            return perlin_noise(
+                height, width, scale, octaves, persistence, lacunarity, seed
+            )
+        # reference implementation only, noise is not needed otherwise
+        from noise import pnoise2
+
         perlin_img = zeros((height, width))
         for i in range(height):
             for j in range(width):
                 perlin_img[i][j] = pnoise2(
                     i * scale,
                     j * scale,
-                    octaves=octaves,
+                    octaves=int(octaves),
                     persistence=persistence,
                     lacunarity=lacunarity,
+                    base=seed,
                 )
         return perlin_img
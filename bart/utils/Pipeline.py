@@ -0,0 +1,413 @@
+from typing import Callable, List, Optional, Tuple
+
+from cv2 import COLOR_GRAY2BGR, cvtColor
+from numpy import ndarray
+from utils.lut_utils import apply_lut, compose_luts
+from utils.float_utils import is_float, to_float, to_uint8
+from utils.registry import GLOBAL, NEIGHBOURHOOD, Effect, get_effects
+from utils.RenderCache import freeze
+from utils.tile_utils import apply_tiled, get_halo
+from utils.trace import span
+
+
+class Stage:
+    """Single effect of the pipeline together with its parameters"""
+
+    def __init__(
+        self,
+        name: str,
+        effect: Callable,
+        params: Optional[dict] = None,
+        is_active: Callable[[dict], bool] = lambda params: True,
+        enabled: bool = True,
+        scale_params: Optional[Callable[[dict, float], dict]] = None,
+        lut: Optional[Callable[[dict], ndarray]] = None,
+        takes_lut: bool = False,
+        in_place: bool = False,
+        cost: str = NEIGHBOURHOOD,
+        cacheable: bool = True,
+        halo: Optional[Callable[[dict], Optional[int]]] = None,
+    ):
+        """
+        lut - builds lookup table of a point operation from the parameters,
+              such stages are fused and applied with a single table
+        takes_lut - effect accepts lut parameter applied as its last pass
+        in_place - effect accepts in_place parameter to reuse the input buffer
+        cost - cost class from utils.registry, global stages are never tiled
+        cacheable - output is kept between renders
+        halo - kernel radius for tiling, defaults to tile_utils.get_halo
+        """
+        self.name = name
+        self.effect = effect
+        self.defaults = dict(params or {})
+        self.params = dict(self.defaults)
+        self.enabled = enabled
+        self._default_enabled = enabled
+        self._is_active = is_active
+        self._scale_params = scale_params
+        self._lut = lut
+        self.takes_lut = takes_lut
+        self.in_place = in_place
+        self.cost = cost
+        self.cacheable = cacheable
+        self._halo = halo
+
+    @classmethod
+    def from_effect(cls, effect: Effect) -> "Stage":
+        """
+        Creates stage of a registered effect with its default parameters
+        """
+        params = effect.get_default_params()
+        enabled = params.pop("enabled", True)
+        return cls(
+            effect.name,
+            effect.get_function(),
+            params,
+            effect.is_active,
+            enabled,
+            effect.scale_params,
+            effect.lut,
+            effect.takes_lut,
+            effect.in_place,
+            effect.cost,
+            effect.cacheable,
+            effect.halo,
+        )
+
+    @property
+    def is_active(self) -> bool:
+        return self.enabled and self._is_active(self.params)
+
+    @property
+    def is_point(self) -> bool:
+        return self._lut is not None
+
+    def get_lut(self) -> ndarray:
+        return self._lut(self.params)
+
+    def update(self, enabled: Optional[bool] = None, **params) -> bool:
+        """
+        Updates stage parameters, returns True if anything changed
+        """
+        was_active = self.is_active
+        old_params = dict(self.params)
+        if enabled is not None:
+            self.enabled = enabled
+        self.params.update(params)
+        if not self.is_active and not was_active:
+            return False
+        return self.is_active != was_active or self.params != old_params
+
+    def reset(self) -> None:
+        self.params = dict(self.defaults)
+        self.enabled = self._default_enabled
+
+    def get_params(self, scale: float = 1.0) -> dict:
+        """
+        Returns parameters adjusted for image downscaled by scale
+        """
+        if scale == 1.0 or self._scale_params is None:
+            return self.params
+        return self._scale_params(dict(self.params), scale)
+
+    def apply(
+        self,
+        image: ndarray,
+        scale: float = 1.0,
+        tile_size: Optional[int] = None,
+        workers: int = 1,
+        **params
+    ) -> ndarray:
+        """
+        Applies the effect, neighbourhood effects are tiled if tile_size is set
+        """
+        if self.is_point and not is_float(image):
+            return apply_point_lut(image, self.get_lut())
+        params = dict(self.get_params(scale), **params)
+        halo = self.get_halo(params) if tile_size else None
+        if halo is None:
+            result = self.effect(image, **params)
+        else:
+            result = apply_tiled(self.effect, image, halo, tile_size, workers, **params)
+        return _match_channels(result, image)
+
+    def get_halo(self, params: dict) -> Optional[int]:
+        """
+        Returns kernel radius for tiling, None if the stage cannot be tiled
+        """
+        if self.cost == GLOBAL:
+            return None
+        if self._halo is not None:
+            return self._halo(params)
+        return get_halo(self.effect, params)
+
+
+def _match_channels(result: ndarray, image: ndarray) -> ndarray:
+    if result.ndim == 2 and image.ndim == 3:
+        # keep the pipeline in BGR for the following stages
+        result = cvtColor(result, COLOR_GRAY2BGR)
+    return result
+
+
+def apply_point_lut(image: ndarray, lut: ndarray) -> ndarray:
+    return _match_channels(apply_lut(image, lut), image)
+
+
+def get_default_stages() -> List[Stage]:
+    """
+    Returns stages of the registered effects in the order they are applied
+    """
+    return [Stage.from_effect(effect) for effect in get_effects()]
+
+
+class Pipeline:
+    """
+    Ordered chain of effect stages
+
+    Output of every stage is cached, so changing parameters of one stage
+    re-runs only that stage and the stages after it. The cached source may
+    be a downscaled proxy, kernel parameters are then scaled to match.
+    """
+
+    def __init__(
+        self,
+        stages: Optional[List[Stage]] = None,
+        tile_size: Optional[int] = None,
+        tile_workers: int = 1,
+        float_mode: bool = False,
+    ):
+        """
+        tile_size - run neighbourhood effects over tiles of this size
+        tile_workers - number of threads processing the tiles
+        float_mode - process in float32 working buffer, see to_uint8
+        """
+        self.stages = stages if stages is not None else get_default_stages()
+        self.tile_size = tile_size
+        self.tile_workers = tile_workers
+        self._float_mode = float_mode
+        self._source = None
+        self._scale = 1.0
+        self._outputs = [None] * len(self.stages)
+        # index of the first stage whose cached output is outdated
+        self._valid = 0
+
+    @property
+    def source(self) -> Optional[ndarray]:
+        return self._source
+
+    @property
+    def scale(self) -> float:
+        return self._scale
+
+    @property
+    def float_mode(self) -> bool:
+        """
+        Effects run on float32 buffer in the 0-255 range without clipping
+        and rounding between stages, results are left for the caller to
+        quantize once with to_uint8
+        """
+        return self._float_mode
+
+    @float_mode.setter
+    def float_mode(self, value: bool) -> None:
+        if value == self._float_mode:
+            return
+        self._float_mode = value
+        if self._source is not None:
+            # uint8 source converts to float32 and back without loss
+            self.set_source(
+                to_float(self._source) if value else to_uint8(self._source),
+                self._scale,
+            )
+
+    def set_source(self, image: ndarray, scale: float = 1.0) -> None:
+        """
+        Sets new input image and drops all cached outputs
+
+        scale - size of the image relative to the full resolution source
+        """
+        self._source = to_float(image) if self._float_mode else image
+        self._scale = scale
+        self.invalidate(0)
+
+    def set_stages(self, stages: Optional[List[Stage]] = None) -> None:
+        """
+        Replaces stages, by default with stages of the registered effects,
+        and drops all cached outputs, the source is kept
+        """
+        self.stages = stages if stages is not None else get_default_stages()
+        self._outputs = [None] * len(self.stages)
+        self.invalidate(0)
+
+    def index(self, name: str) -> int:
+        for i, stage in enumerate(self.stages):
+            if stage.name == name:
+                return i
+        raise KeyError("Unknown pipeline stage: %s" % name)
+
+    def stage(self, name: str) -> Stage:
+        return self.stages[self.index(name)]
+
+    def set_params(self, name: str, **params) -> None:
+        """
+        Updates parameters of the stage, invalidates cache from the stage on
+        """
+        index = self.index(name)
+        if self.stages[index].update(**params):
+            self.invalidate(index)
+
+    def get_params(self) -> dict:
+        """
+        Returns snapshot of parameters of all stages
+        """
+        return {
+            stage.name: dict(stage.params, enabled=stage.enabled)
+            for stage in self.stages
+        }
+
+    def update(self, params: dict) -> None:
+        """
+        Sets parameters of multiple stages from a snapshot
+        """
+        for name, stage_params in params.items():
+            self.set_params(name, **stage_params)
+
+    def get_render_key(self) -> tuple:
+        """
+        Returns canonical parameters of active stages
+        """
+        key = tuple(
+            (stage.name, freeze(stage.params))
+            for stage in self.stages
+            if stage.is_active
+        )
+        return key + (("float_mode", True),) if self._float_mode else key
+
+    def invalidate(self, index: int = 0) -> None:
+        self._valid = min(self._valid, index)
+        for i in range(index, len(self._outputs)):
+            self._outputs[i] = None
+
+    def reset(self) -> None:
+        """
+        Restores default parameters of all stages
+        """
+        for stage in self.stages:
+            stage.reset()
+        self.invalidate(0)
+
+    def render(
+        self, is_cancelled: Optional[Callable[[], bool]] = None
+    ) -> Optional[ndarray]:
+        """
+        Returns output of the last stage, reusing cached outputs
+
+        is_cancelled is checked between stages, None is returned when it
+        reports True. Outputs of finished stages stay cached.
+        """
+        if self._source is None:
+            return None
+        # fused runs keep only the output of the last stage, runs of stages
+        # which are not cacheable keep none
+        i = self._valid
+        while i > 0 and self._outputs[i - 1] is None:
+            i -= 1
+        image = self._source if i == 0 else self._outputs[i - 1]
+        while i < len(self.stages):
+            if is_cancelled is not None and is_cancelled():
+                self._valid = i
+                return None
+            stop, image = self._apply_from(i, image, self._scale)
+            for j in range(i, stop):
+                self._outputs[j] = None
+            # cheap stages are recomputed, the final output is always kept
+            if self.stages[i].cacheable or stop == len(self.stages):
+                self._outputs[stop - 1] = image
+            i = stop
+        self._valid = len(self.stages)
+        return self._outputs[-1] if self.stages else self._source
+
+    def apply(
+        self,
+        image: ndarray,
+        scale: float = 1.0,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> ndarray:
+        """
+        Applies all active stages to the image without touching the cache
+
+        In float mode the image is converted once and the stages reuse the
+        working buffer where they can. progress is called with the number of
+        finished and of all stages.
+        """
+        if self._float_mode:
+            image = to_float(image)
+        i = 0
+        while i < len(self.stages):
+            i, image = self._apply_from(i, image, scale, self._float_mode)
+            if progress is not None:
+                progress(i, len(self.stages))
+        return image
+
+    def _get_point_run(self, index: int) -> Tuple[List[ndarray], int]:
+        """
+        Returns lookup tables of active point stages starting at index
+        and index of the stage following the last of them
+        """
+        luts = []
+        stop = index
+        for i in range(index, len(self.stages)):
+            stage = self.stages[i]
+            if not stage.is_active:
+                continue
+            if not stage.is_point:
+                break
+            luts.append(stage.get_lut())
+            stop = i + 1
+        return luts, stop
+
+    def _apply_from(
+        self, index: int, image: ndarray, scale: float, in_place: bool = False
+    ) -> Tuple[int, ndarray]:
+        """
+        Applies stage at index fused with following point stages,
+        returns index of the next stage to apply and the result
+
+        in_place - image is a working buffer which the stages may overwrite
+        """
+        stage = self.stages[index]
+        if not stage.is_active:
+            return index + 1, image
+        with span(stage.name) as current:
+            stop, image = self._apply_run(index, image, scale, in_place)
+            if current is not None and stop > index + 1:
+                # fused stages are timed together
+                current.name = "+".join(
+                    stage.name for stage in self.stages[index:stop] if stage.is_active
+                )
+        return stop, image
+
+    def _apply_run(
+        self, index: int, image: ndarray, scale: float, in_place: bool
+    ) -> Tuple[int, ndarray]:
+        stage = self.stages[index]
+        if is_float(image):
+            # lookup tables are 8 bit only, float stages run one by one
+            params = {"in_place": True} if in_place and stage.in_place else {}
+            return index + 1, stage.apply(
+                image, scale, self.tile_size, self.tile_workers, **params
+            )
+        if stage.is_point:
+            luts, stop = self._get_point_run(index)
+            return stop, apply_point_lut(image, compose_luts(*luts))
+        if stage.takes_lut:
+            luts, stop = self._get_point_run(index + 1)
+            if luts:
+                return stop, stage.apply(
+                    image,
+                    scale,
+                    self.tile_size,
+                    self.tile_workers,
+                    lut=compose_luts(*luts),
+                )
+        return index + 1, stage.apply(image, scale, self.tile_size, self.tile_workers)
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from typing import TYPE_CHECKING, Hashable, Optional
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+# default budget of cached images in bytes
+CACHE_SIZE = 512 * 2**20
+
+
+def get_image_hash(image: "ndarray") -> str:
+    """
+    Returns content hash of the image
+    """
+    digest = blake2b(digest_size=16)
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(memoryview(image if image.flags.c_contiguous else image.copy()))
+    return digest.hexdigest()
+
+
+def freeze(value) -> Hashable:
+    """
+    Converts parameters to a canonical hashable form
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if hasattr(value, "tobytes"):
+        # numpy arrays, checked without importing numpy
+        return (value.shape, value.dtype.str, value.tobytes())
+    return value
+
+
+class RenderCache:
+    """
+    Byte budgeted LRU cache of rendered images
+
+    Keys are built from the source content hash and the effect parameters.
+    Cached images are shared, callers must not modify them. Thread safe.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def get_key(source_hash: str, *params) -> tuple:
+        return (source_hash,) + tuple(freeze(item) for item in params)
+
+    def get(self, key: tuple) -> Optional["ndarray"]:
+        with self._lock:
+            image = self._items.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: tuple, image: "ndarray") -> None:
+        if image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._items[key] = image
+            self._bytes += image.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes occupied by cached images
+        """
+        return self._bytes
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "items": len(self._items),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
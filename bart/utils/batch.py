@@ -0,0 +1,274 @@
+"""
+Headless batch processing of images with an effect recipe
+
+Recipe is a JSON or YAML list of effects, e.g.
+    [{"effect": "get_blured_image", "degree": 5}, {"effect": "vignette_image"}]
+where effect names match ImageEffects.get_* methods (the get_ prefix is
+optional) and the remaining keys are passed as parameters.
+
+Usage (from the bart directory):
+    python Bart.py batch recipe.json "photos/*.jpeg" -o "out/{stem}.png" -j 4
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from typing import List, Optional, Tuple
+
+from cv2 import setNumThreads
+from numpy import ndarray
+from utils.ImageEffects import ImageEffects
+from utils.RenderCache import RenderCache, get_image_hash
+from utils.file_utils import open_image, save_image
+from utils.float_utils import to_float
+from utils.tile_utils import apply_tiled, get_halo
+
+Recipe = List[Tuple[str, dict]]
+
+# effects generating an image of given size instead of changing one
+NON_IMAGE_EFFECTS = ("get_perlin_noise", "get_noise_atlas")
+
+# render cache of the worker process, see _init_worker
+_render_cache = None
+
+
+def load_recipe(path: str) -> Recipe:
+    """
+    Loads recipe from JSON or YAML file
+    """
+    with open(path, encoding="utf-8") as file:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    "YAML recipes require PyYAML, install it or use JSON"
+                ) from None
+
+            try:
+                steps = yaml.safe_load(file)
+            except yaml.YAMLError as exc:
+                raise ValueError("Invalid recipe %s: %s" % (path, exc)) from None
+        else:
+            steps = json.load(file)
+    return parse_recipe(steps)
+
+
+def parse_recipe(steps: list) -> Recipe:
+    """
+    Validates recipe steps and resolves effect names
+
+    Parameter names are checked against the effect, their values are not.
+    """
+    if not isinstance(steps, list):
+        raise ValueError(
+            "Recipe must be a list of steps, not %s" % type(steps).__name__
+        )
+    recipe = []
+    for step in steps:
+        if not isinstance(step, dict):
+            raise ValueError("Recipe step must be a mapping: %r" % (step,))
+        params = dict(step)
+        name = params.pop("effect", None)
+        if name is None:
+            raise ValueError("Recipe step is missing effect name: %s" % step)
+        if not isinstance(name, str):
+            raise ValueError("Effect name must be a string: %r" % (name,))
+        if not name.startswith("get_"):
+            name = "get_" + name
+        if not hasattr(ImageEffects, name):
+            raise ValueError("Unknown effect: %s" % name)
+        if name in NON_IMAGE_EFFECTS:
+            raise ValueError("Effect does not take an image: %s" % name)
+        try:
+            inspect.signature(getattr(ImageEffects, name)).bind(None, **params)
+        except TypeError as exc:
+            raise ValueError("Invalid parameters of %s: %s" % (name, exc)) from None
+        recipe.append((name, params))
+    return recipe
+
+
+def apply_recipe(
+    image: ndarray,
+    recipe: Recipe,
+    tile_size: Optional[int] = None,
+    float_mode: bool = False,
+) -> ndarray:
+    """
+    Applies recipe effects to the image in order
+
+    tile_size - run neighbourhood effects over tiles to bound memory
+    float_mode - process in float32, the result is quantized when saved
+    """
+    if float_mode:
+        image = to_float(image)
+    for name, params in recipe:
+        effect = getattr(ImageEffects, name)
+        halo = get_halo(effect, params) if tile_size else None
+        if halo is None:
+            image = effect(image, **params)
+        else:
+            image = apply_tiled(effect, image, halo, tile_size, **params)
+    return image
+
+
+def get_output_path(output: str, input_path: str) -> str:
+    """
+    Returns output path for the input file
+
+    output is either a directory or a template with {name}, {stem}, {suffix}
+    """
+    name = os.path.basename(input_path)
+    stem, suffix = os.path.splitext(name)
+    if "{" in output:
+        return output.format(name=name, stem=stem, suffix=suffix)
+    return os.path.join(output, name)
+
+
+def process_file(
+    recipe: Recipe,
+    input_path: str,
+    output_path: str,
+    tile_size: Optional[int] = None,
+    float_mode: bool = False,
+) -> Tuple[str, float, Optional[str]]:
+    """
+    Processes single file, returns output path, elapsed time and error
+    """
+    start = time.perf_counter()
+    try:
+        image = open_image(input_path)
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if _render_cache is None:
+            result = apply_recipe(image, recipe, tile_size, float_mode)
+        else:
+            key = _render_cache.get_key(get_image_hash(image), recipe, float_mode)
+            result = _render_cache.get(key)
+            if result is None:
+                result = apply_recipe(image, recipe, tile_size, float_mode)
+                _render_cache.put(key, result)
+        save_image(output_path, result)
+        error = None
+    except Exception as exc:
+        error = "%s: %s" % (type(exc).__name__, exc)
+    return output_path, time.perf_counter() - start, error
+
+
+def _init_worker(cache_size: int = 0) -> None:
+    global _render_cache
+    # parallelism comes from the processes, keep OpenCV single threaded
+    setNumThreads(1)
+    _render_cache = RenderCache(cache_size) if cache_size else None
+
+
+def run(
+    recipe: Recipe,
+    inputs: List[str],
+    output: str,
+    workers: Optional[int] = None,
+    tile_size: Optional[int] = None,
+    cache_size: int = 0,
+    float_mode: bool = False,
+    stream=sys.stdout,
+) -> int:
+    """
+    Processes all files matching inputs globs, returns number of failures
+    """
+    paths = sorted({path for pattern in inputs for path in glob(pattern)})
+    if not paths:
+        print("No input files matched", file=stream)
+        return 0
+
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(cache_size,)
+    ) as pool:
+        futures = {
+            pool.submit(
+                process_file,
+                recipe,
+                path,
+                get_output_path(output, path),
+                tile_size,
+                float_mode,
+            ): path
+            for path in paths
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            output_path, elapsed, error = future.result()
+            if error:
+                failures += 1
+                status = "FAILED %s" % error
+            else:
+                status = "-> %s" % output_path
+            print(
+                "[%d/%d] %s %s (%.2f s)"
+                % (done, len(paths), futures[future], status, elapsed),
+                file=stream,
+                flush=True,
+            )
+    print(
+        "Processed %d files in %.2f s, %d failed"
+        % (len(paths), time.perf_counter() - start, failures),
+        file=stream,
+    )
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="bart batch", description="Apply effect recipe to images"
+    )
+    parser.add_argument("recipe", help="JSON or YAML recipe file")
+    parser.add_argument("inputs", nargs="+", help="input file globs")
+    parser.add_argument(
+        "-o", "--output", required=True, help="output directory or path template"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=None,
+        help="process neighbourhood effects in tiles of this size to bound memory",
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=0,
+        help="render cache budget of every worker for repeated identical inputs",
+    )
+    parser.add_argument(
+        "--float",
+        action="store_true",
+        help="process in float32 and round to 8 bit only when saving",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (ImportError, OSError, ValueError) as exc:
+        print("%s: %s" % (type(exc).__name__, exc), file=sys.stderr)
+        return 1
+    failures = run(
+        recipe,
+        args.inputs,
+        args.output,
+        args.workers,
+        args.tile_size,
+        args.cache_mb * 2**20,
+        args.float,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
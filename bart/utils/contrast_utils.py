@@ -0,0 +1,29 @@
+from threading import local
+
+from cv2 import createCLAHE
+
+# tiles of the histogram grid along each axis
+GRID_SIZE = 8
+# number of cached CLAHE instances per thread
+CLAHE_CACHE_SIZE = 8
+
+# CLAHE instances keep internal buffers, every thread gets its own
+_cache = local()
+
+
+def get_clahe(clip_limit: float, grid: int = GRID_SIZE):
+    """
+    Returns cached CLAHE instance for the clip limit and grid
+    """
+    items = getattr(_cache, "items", None)
+    if items is None:
+        items = _cache.items = {}
+    key = (clip_limit, grid)
+    clahe = items.get(key)
+    if clahe is None:
+        if len(items) >= CLAHE_CACHE_SIZE:
+            del items[next(iter(items))]
+        clahe = items[key] = createCLAHE(
+            clipLimit=clip_limit, tileGridSize=(grid, grid)
+        )
+    return clahe
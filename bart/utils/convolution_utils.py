@@ -0,0 +1,155 @@
+from functools import lru_cache
+from math import ceil
+from typing import Optional, Tuple
+
+import numpy as np
+from cv2 import (
+    CV_32F,
+    INTER_AREA,
+    INTER_LINEAR,
+    boxFilter,
+    filter2D,
+    getGaussianKernel,
+    resize,
+    sepFilter2D,
+)
+
+# kernels up to this size are applied directly
+DIRECT_SIZE = 11
+# separable kernels from this size on are cheaper through FFT
+FFT_SIZE = 61
+# guided filter coefficients are computed at full resolution up to this radius
+GUIDED_RADIUS = 4
+
+EMBOSS_KERNEL = np.array([[0, -1, -1], [1, 0, -1], [1, 1, 0]], dtype=np.float32)
+EMBOSS_KERNEL.flags.writeable = False
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+@lru_cache(maxsize=64)
+def get_gaussian_kernel(size: int, sigma: float = 0) -> np.ndarray:
+    """
+    Returns 1D gaussian kernel, sigma 0 is derived from size like GaussianBlur
+    """
+    return _read_only(getGaussianKernel(size, sigma, ktype=CV_32F).ravel())
+
+
+def get_gaussian_size(sigma: float) -> int:
+    """
+    Returns odd kernel size covering 3 sigma
+    """
+    return 2 * ceil(3 * sigma) + 1
+
+
+@lru_cache(maxsize=64)
+def get_sharpen_kernel(degree: float) -> np.ndarray:
+    return _read_only(
+        np.array(
+            [[0, -degree, 0], [-degree, 1 + 4 * degree, -degree], [0, -degree, 0]],
+            dtype=np.float32,
+        )
+    )
+
+
+@lru_cache(maxsize=64)
+def _get_separable_factors(
+    data: bytes, shape: Tuple[int, int]
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    kernel = np.frombuffer(data, dtype=np.float64).reshape(shape)
+    u, s, vt = np.linalg.svd(kernel)
+    if len(s) > 1 and s[1] > s[0] * 1e-6:
+        return None
+    root = np.sqrt(s[0])
+    kernel_y = _read_only((u[:, 0] * root).astype(np.float32))
+    kernel_x = _read_only((vt[0] * root).astype(np.float32))
+    return kernel_x, kernel_y
+
+
+def get_separable_factors(
+    kernel: np.ndarray,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns (kernel_x, kernel_y) if the kernel has rank 1, otherwise None
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    return _get_separable_factors(kernel.tobytes(), kernel.shape)
+
+
+def get_method(kernel: np.ndarray) -> str:
+    """
+    Returns cheapest method for the kernel: direct, separable or fft
+    """
+    size = max(kernel.shape)
+    if size <= DIRECT_SIZE:
+        return "direct"
+    if size < FFT_SIZE and get_separable_factors(kernel) is not None:
+        return "separable"
+    return "fft"
+
+
+def convolve(image: np.ndarray, kernel: np.ndarray, method: str = None) -> np.ndarray:
+    """
+    Filters the image with the kernel like cv2.filter2D (correlation,
+    reflected border, same depth), choosing the method per kernel
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    method = method or get_method(kernel)
+    if method == "separable":
+        kernel_x, kernel_y = get_separable_factors(kernel)
+        return convolve_separable(image, kernel_x, kernel_y)
+    # filter2D correlates kernels larger than 11x11 through its own DFT,
+    # which is several times faster than numpy.fft for the same kernel
+    return filter2D(image, -1, kernel)
+
+
+def convolve_separable(
+    image: np.ndarray, kernel_x: np.ndarray, kernel_y: np.ndarray
+) -> np.ndarray:
+    """
+    Filters the image with a rank-1 kernel given by its factors, switching
+    to the full kernel through FFT when that is cheaper
+    """
+    if max(len(kernel_x), len(kernel_y)) >= FFT_SIZE:
+        return filter2D(image, -1, np.outer(kernel_y, kernel_x))
+    return sepFilter2D(image, -1, kernel_x, kernel_y)
+
+
+def guided_filter(image: np.ndarray, radius: int, eps: float) -> np.ndarray:
+    """
+    Edge preserving smoothing of every channel guided by itself
+
+    Built on box filters, so the cost does not depend on the radius. The
+    linear coefficients are smooth and are computed at reduced resolution
+    for larger radii. eps is the variance (in 0-255 units squared) below
+    which detail is smoothed out, like sigmaColor squared of bilateral filter.
+    """
+    guide = image.astype(np.float32)
+    step = max(1, radius // GUIDED_RADIUS)
+    small = guide
+    if step > 1:
+        size = (-(-image.shape[1] // step), -(-image.shape[0] // step))
+        small = resize(guide, size, interpolation=INTER_AREA)
+    window = (2 * (radius // step) + 1,) * 2
+    mean = boxFilter(small, -1, window)
+    variance = boxFilter(small * small, -1, window)
+    variance -= mean * mean
+    # local linear model result = a * guide + b
+    a = variance
+    a /= variance + eps
+    b = mean
+    b -= a * mean
+    a = boxFilter(a, -1, window)
+    b = boxFilter(b, -1, window)
+    if step > 1:
+        size = (image.shape[1], image.shape[0])
+        a = resize(a, size, interpolation=INTER_LINEAR)
+        b = resize(b, size, interpolation=INTER_LINEAR)
+    a *= guide
+    a += b
+    if image.dtype == np.uint8:
+        np.clip(a, 0, 255, out=a)
+    return a.astype(image.dtype, copy=False)
@@ -1,25 +1,205 @@
-from cv2 import imread, imwrite
+import os
+import struct
+import tempfile
+from typing import List, Optional, Tuple
+
+from cv2 import (
+    IMREAD_COLOR,
+    IMREAD_REDUCED_COLOR_2,
+    IMREAD_REDUCED_COLOR_4,
+    IMREAD_REDUCED_COLOR_8,
+    IMWRITE_JPEG_QUALITY,
+    IMWRITE_PNG_COMPRESSION,
+    IMWRITE_WEBP_QUALITY,
+    error,
+    imencode,
+    imread,
+)
 import numpy as np
+from utils.float_utils import to_uint8
+
+# JPEG decoder can scale by these factors while decoding
+REDUCED_FLAGS = (
+    (8, IMREAD_REDUCED_COLOR_8),
+    (4, IMREAD_REDUCED_COLOR_4),
+    (2, IMREAD_REDUCED_COLOR_2),
+)
+JPEG_SUFFIXES = (".jpg", ".jpeg", ".jpe")
+PNM_SUFFIXES = (".ppm", ".pgm", ".pnm")
+
+# zlib level 0-9, higher levels take much longer for a few percent smaller
+# files (24 Mpx photo: level 1 in 2.6 s, 3 in 3.7 s, 9 in 41 s)
+PNG_COMPRESSION = 1
+# 0-100
+JPEG_QUALITY = 95
+# 1-100, above 100 is lossless
+WEBP_QUALITY = 90
 
 
 def open_image(path: str) -> np.ndarray:
     """
-    Loads and image as a ndarray
+    Loads an image as a ndarray
+
+    Uncompressed .npy and 8 bit binary PPM/PGM files are memory-mapped
+    read-only instead of being read into memory.
     """
-    try:
-        image = imread(path)
-        if image is None:
-            raise FileNotFoundError("File does not exist or is not supported: %s", path)
+    if not os.path.isfile(path):
+        raise FileNotFoundError("File does not exist: %s" % path)
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".npy":
+        image = np.load(path, mmap_mode="r")
+        if image.dtype != np.uint8 or not (
+            image.ndim == 2 or image.ndim == 3 and image.shape[2] == 3
+        ):
+            raise ValueError(
+                "Array is not an 8 bit gray or BGR image: %s %s %s"
+                % (path, image.dtype, image.shape)
+            )
         return image
-    except FileNotFoundError as exc:
-        print("Error occurred while opening the image: %s", path)
+    if suffix in PNM_SUFFIXES:
+        image = _map_pnm(path)
+        if image is not None:
+            return image
+    image = imread(path, IMREAD_COLOR)
+    if image is None:
+        raise ValueError("File is not a supported image: %s" % path)
+    return image
+
 
+def open_preview(path: str, width: int, height: int) -> Tuple[np.ndarray, float]:
+    """
+    Loads an image at least width x height large (unless it is smaller)
+    as cheaply as possible, returns it with its scale relative to the
+    full image
 
-def save_image(path: str, image: np.ndarray) -> None:
+    JPEG files are decoded directly at 1/2, 1/4 or 1/8 of their size. The
+    header size is not rotated by the EXIF orientation, so only the shorter
+    and longer sides are compared.
     """
-    Saves and image
+    if os.path.splitext(path)[1].lower() in JPEG_SUFFIXES:
+        size = get_jpeg_size(path)
+        if size is not None:
+            short_side, long_side = sorted(size)
+            short_min, long_min = sorted((width, height))
+            for factor, flag in REDUCED_FLAGS:
+                if (
+                    short_side // factor >= short_min
+                    and long_side // factor >= long_min
+                ):
+                    image = imread(path, flag)
+                    if image is None:
+                        break
+                    return image, max(image.shape[:2]) / long_side
+    return open_image(path), 1.0
+
+
+def get_jpeg_size(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns (width, height) from the JPEG frame header without decoding
+    """
+    with open(path, "rb") as file:
+        if file.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] in (0x01, 0xD8) or 0xD0 <= marker[1] <= 0xD7:
+                continue
+            (length,) = struct.unpack(">H", file.read(2))
+            # start of frame markers except DHT, JPG and DAC
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                _, height, width = struct.unpack(">BHH", file.read(5))
+                return width, height
+            file.seek(length - 2, os.SEEK_CUR)
+
+
+def _map_pnm(path: str) -> Optional[np.ndarray]:
     """
+    Memory-maps binary 8 bit PPM as BGR view or PGM as grayscale,
+    returns None for other variants
+    """
+    with open(path, "rb") as file:
+        header = file.read(512)
+    tokens = []
+    position = 0
+    while len(tokens) < 4 and position < len(header):
+        if header[position : position + 1].isspace():
+            position += 1
+        elif header[position : position + 1] == b"#":
+            position = header.find(b"\n", position) + 1 or len(header)
+        else:
+            end = position
+            while end < len(header) and not header[end : end + 1].isspace():
+                end += 1
+            tokens.append(header[position:end])
+            position = end
+    if len(tokens) < 4 or tokens[0] not in (b"P5", b"P6") or int(tokens[3]) > 255:
+        return None
+    width, height = int(tokens[1]), int(tokens[2])
+    shape = (height, width, 3) if tokens[0] == b"P6" else (height, width)
+    # single whitespace separates the header from the pixel data
+    image = np.memmap(path, np.uint8, "r", offset=position + 1, shape=shape)
+    # PPM is RGB, reversed channel view keeps it mapped
+    return image[..., ::-1] if image.ndim == 3 else image
+
+
+def get_write_params(
+    path: str, quality: Optional[int] = None, compression: Optional[int] = None
+) -> List[int]:
+    """
+    Returns encoder parameters for the format given by the file extension
+
+    quality - JPEG (0-100) or WebP (1-100, above 100 lossless) quality
+    compression - PNG compression level (0-9)
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in JPEG_SUFFIXES:
+        return [IMWRITE_JPEG_QUALITY, JPEG_QUALITY if quality is None else quality]
+    if suffix == ".webp":
+        return [IMWRITE_WEBP_QUALITY, WEBP_QUALITY if quality is None else quality]
+    if suffix == ".png":
+        return [
+            IMWRITE_PNG_COMPRESSION,
+            PNG_COMPRESSION if compression is None else compression,
+        ]
+    return []
+
+
+def save_image(
+    path: str,
+    image: np.ndarray,
+    quality: Optional[int] = None,
+    compression: Optional[int] = None,
+) -> None:
+    """
+    Saves an image, float32 working buffers are quantized to uint8
+
+    The image is encoded in memory and written to a temporary file which
+    replaces the target, so a failed or interrupted save never leaves a
+    partial file behind. See get_write_params for quality and compression.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    try:
+        ok, data = imencode(
+            suffix, to_uint8(image), get_write_params(path, quality, compression)
+        )
+    except error as exc:
+        raise ValueError("Unsupported image format: %s" % path) from exc
+    if not ok:
+        raise ValueError("Could not encode the image: %s" % path)
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=".", dir=directory)
     try:
-        imwrite(path, image)
-    except Exception as exc:
-        print("Error occurred while saving the image: %s", path)
+        with os.fdopen(handle, "wb") as file:
+            file.write(data)
+        # temporary files are private, keep permissions of a replaced file
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(temp_path, mode & 0o777)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
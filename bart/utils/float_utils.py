@@ -0,0 +1,27 @@
+import numpy as np
+
+# working buffers of the float mode hold values in the 0-255 range of uint8
+# images, values out of range are kept until the final quantization
+WORKING_DTYPE = np.float32
+
+
+def is_float(image: np.ndarray) -> bool:
+    return image.dtype == WORKING_DTYPE
+
+
+def to_float(image: np.ndarray) -> np.ndarray:
+    """
+    Returns float32 working copy of the image
+    """
+    return image.astype(WORKING_DTYPE)
+
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    """
+    Rounds and clips working buffer to uint8, uint8 images are returned as is
+    """
+    if image.dtype == np.uint8:
+        return image
+    result = np.rint(image)
+    np.clip(result, 0, 255, out=result)
+    return result.astype(np.uint8)
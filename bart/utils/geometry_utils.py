@@ -0,0 +1,117 @@
+from math import floor
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from cv2 import (
+    ROTATE_180,
+    ROTATE_90_CLOCKWISE,
+    ROTATE_90_COUNTERCLOCKWISE,
+    getPerspectiveTransform,
+    getRotationMatrix2D,
+)
+
+# top left, top right, bottom left and bottom right corner
+Points = Sequence[Tuple[float, float]]
+
+# cv2.rotate codes by number of counterclockwise quarter turns
+TURNS = (None, ROTATE_90_COUNTERCLOCKWISE, ROTATE_180, ROTATE_90_CLOCKWISE)
+
+
+def split_angle(angle: float) -> Tuple[int, float]:
+    """
+    Returns number of counterclockwise quarter turns (0-3) and the rest
+    of the angle in <-45, 45)
+    """
+    turns = floor(angle / 90 + 0.5)
+    return turns % 4, angle - 90 * turns
+
+
+def get_turn_matrix(turns: int, width: int, height: int) -> np.ndarray:
+    """
+    Returns 3x3 matrix moving pixels where cv2.rotate puts them
+    """
+    right, bottom = width - 1, height - 1
+    return np.array(
+        (
+            [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+            [[0, 1, 0], [-1, 0, right], [0, 0, 1]],
+            [[-1, 0, right], [0, -1, bottom], [0, 0, 1]],
+            [[0, -1, bottom], [1, 0, 0], [0, 0, 1]],
+        )[turns],
+        dtype=np.float64,
+    )
+
+
+def get_rotation_matrix(
+    angle: float, width: int, height: int
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Returns 3x3 matrix rotating around the center counterclockwise and
+    (width, height) of the bounds containing the whole rotated image
+    """
+    matrix = getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    abs_cos, abs_sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    bound_w = int(height * abs_sin + width * abs_cos)
+    bound_h = int(height * abs_cos + width * abs_sin)
+    matrix[0, 2] += bound_w / 2 - width / 2
+    matrix[1, 2] += bound_h / 2 - height / 2
+    return np.vstack((matrix, [0, 0, 1])), (bound_w, bound_h)
+
+
+def get_perspective_matrix(points: Points, width: int, height: int) -> np.ndarray:
+    """
+    Returns 3x3 homography stretching the quadrilateral to the whole image
+    """
+    corners = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    return getPerspectiveTransform(np.float32(points), corners)
+
+
+def get_geometry(
+    width: int, height: int, angle: float = 0, points: Optional[Points] = None
+) -> Tuple[int, Optional[np.ndarray], Tuple[int, int]]:
+    """
+    Composes perspective correction and rotation of an image
+
+    Returns quarter turns to apply exactly with cv2.rotate, homography of
+    the turned image to the output (None when no resampling is needed)
+    and output (width, height).
+    """
+    turns, rest = split_angle(angle)
+    if points is None and rest == 0:
+        size = (height, width) if turns % 2 else (width, height)
+        return turns, None, size
+    matrix = np.eye(3)
+    if points is not None:
+        matrix = get_perspective_matrix(points, width, height)
+    turn = get_turn_matrix(turns, width, height)
+    matrix = turn @ matrix
+    size = (height, width) if turns % 2 else (width, height)
+    if rest != 0:
+        rotation, size = get_rotation_matrix(rest, *size)
+        matrix = rotation @ matrix
+    # the turn is already applied to the input of the homography
+    return turns, matrix @ np.linalg.inv(turn), size
+
+
+def get_frame(
+    width: int, height: int, angle: float = 0, points: Optional[Points] = None
+) -> Optional[np.ndarray]:
+    """
+    Returns corners of the corrected image in the output of get_geometry
+    as a 4x2 array, None when it covers the whole output
+
+    Outside of it the composed homography samples the image around the
+    quadrilateral, which the perspective correction alone would crop.
+    """
+    turns, rest = split_angle(angle)
+    if points is None or rest == 0:
+        return None
+    turn = get_turn_matrix(turns, width, height)
+    size = (height, width) if turns % 2 else (width, height)
+    rotation, _ = get_rotation_matrix(rest, *size)
+    corners = np.float64([[0, 0, 1], [width, 0, 1], [width, height, 1], [0, height, 1]])
+    return (corners @ (rotation @ turn).T)[:, :2]
+
+
+def is_affine(matrix: np.ndarray) -> bool:
+    return np.allclose(matrix[2], (0, 0, 1))
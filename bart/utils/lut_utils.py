@@ -0,0 +1,83 @@
+from typing import Sequence
+
+import numpy as np
+from cv2 import COLOR_GRAY2BGR, LUT, cvtColor
+
+# lookup tables are (channels, 256) uint8 arrays, one row per image channel
+VALUES = np.arange(256, dtype=np.float32)
+
+
+def _to_lut(values: np.ndarray, channels: int = 3) -> np.ndarray:
+    lut = np.clip(np.rint(values), 0, 255).astype(np.uint8)
+    if lut.ndim == 1:
+        lut = np.tile(lut, (channels, 1))
+    return lut
+
+
+def get_identity_lut(channels: int = 3) -> np.ndarray:
+    return _to_lut(VALUES, channels)
+
+
+def get_offset_lut(
+    offset: float, channels: int = 3, saturate: bool = True
+) -> np.ndarray:
+    """
+    Addition of a scalar, saturating like cv2.add or wrapping around
+    like numpy.add on uint8 arrays
+    """
+    if saturate:
+        return _to_lut(VALUES + offset, channels)
+    return _to_lut((VALUES + np.rint(offset)) % 256, channels)
+
+
+def get_brightness_lut(degree: float, channels: int = 3) -> np.ndarray:
+    """
+    Same as cv2.convertScaleAbs with alpha=1 and beta=degree
+    """
+    return _to_lut(np.abs(VALUES + degree), channels)
+
+
+def get_inverted_lut(channels: int = 3) -> np.ndarray:
+    return _to_lut(255 - VALUES, channels)
+
+
+def get_channel_lut(offsets: Sequence[float]) -> np.ndarray:
+    """
+    Saturating addition of a separate offset to every channel
+    """
+    return _to_lut(VALUES[None, :] + np.asarray(offsets, np.float32)[:, None])
+
+
+def get_rgb_lut(color: Sequence[float]) -> np.ndarray:
+    """
+    Channel offsets given as (red, green, blue) for a BGR image
+    """
+    return get_channel_lut(np.clip(color, -255, 255)[::-1])
+
+
+def compose_luts(*luts: np.ndarray) -> np.ndarray:
+    """
+    Returns table equal to applying the luts in order
+    """
+    result = luts[0]
+    for lut in luts[1:]:
+        result = np.take_along_axis(lut, result.astype(np.intp), axis=1)
+    return result
+
+
+def is_uniform(lut: np.ndarray) -> bool:
+    """
+    Returns True if all channels use the same table
+    """
+    return bool((lut == lut[0]).all())
+
+
+def apply_lut(image: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Applies lookup table to the image in a single pass
+    """
+    if is_uniform(lut):
+        return LUT(image, lut[0])
+    if image.ndim == 2:
+        image = cvtColor(image, COLOR_GRAY2BGR)
+    return LUT(image, np.ascontiguousarray(lut.T).reshape(256, 1, lut.shape[0]))
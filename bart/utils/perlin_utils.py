@@ -0,0 +1,185 @@
+import numpy as np
+
+# gradient directions used by the reference implementation (x, y of GRAD3)
+GRADIENTS = np.array(
+    [
+        [1, 1],
+        [-1, 1],
+        [1, -1],
+        [-1, -1],
+        [1, 0],
+        [-1, 0],
+        [1, 0],
+        [-1, 0],
+        [0, 1],
+        [0, -1],
+        [0, 1],
+        [0, -1],
+    ],
+    dtype=np.float32,
+)
+
+# gradient components indexed directly by permutation value
+GRADIENTS_X = GRADIENTS[np.arange(512) % len(GRADIENTS), 0]
+GRADIENTS_Y = GRADIENTS[np.arange(512) % len(GRADIENTS), 1]
+
+# number of rows evaluated at once, bounds the size of temporaries
+BAND_ROWS = 256
+
+
+def get_permutation(seed: int = 0) -> np.ndarray:
+    """
+    Returns doubled permutation table for given seed
+    """
+    permutation = np.random.default_rng(seed).permutation(256)
+    return np.concatenate((permutation, permutation)).astype(np.int32)
+
+
+def _fade(t: np.ndarray) -> np.ndarray:
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def _gradient(hashes: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return GRADIENTS_X[hashes] * x + GRADIENTS_Y[hashes] * y
+
+
+def gradient_noise(
+    x: np.ndarray, y: np.ndarray, permutation: np.ndarray, period: int = 0
+) -> np.ndarray:
+    """
+    Evaluates single octave of 2D gradient noise on a grid
+
+    x column vector (rows, 1), y row vector (1, cols)
+    period - lattice cells after which the noise repeats, 0 for 256
+    """
+    x_floor = np.floor(x)
+    y_floor = np.floor(y)
+    xi = x_floor.astype(np.int32)
+    yi = y_floor.astype(np.int32)
+    xf = (x - x_floor).astype(np.float32)
+    yf = (y - y_floor).astype(np.float32)
+    u = _fade(xf)
+    v = _fade(yf)
+
+    if period:
+        xi, xj = xi % period & 255, (xi + 1) % period & 255
+        yi, yj = yi % period & 255, (yi + 1) % period & 255
+    else:
+        xi, yi = xi & 255, yi & 255
+        xj, yj = xi + 1, yi + 1
+    a = permutation[xi]
+    b = permutation[xj]
+    aa = permutation[a + yi]
+    ab = permutation[a + yj]
+    ba = permutation[b + yi]
+    bb = permutation[b + yj]
+
+    x1 = _gradient(aa, xf, yf)
+    x1 += u * (_gradient(ba, xf - 1, yf) - x1)
+    x2 = _gradient(ab, xf, yf - 1)
+    x2 += u * (_gradient(bb, xf - 1, yf - 1) - x2)
+    x1 += v * (x2 - x1)
+    return x1
+
+
+def perlin_noise(
+    height: int,
+    width: int,
+    scale: float = 0.1,
+    octaves: int = 1,
+    persistence: float = 0.5,
+    lacunarity: float = 2.0,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Generates fractal perlin noise of given size as float32 array
+
+    Rows are sampled at x = row * scale and columns at y = col * scale,
+    same as the pnoise2 loop. Result is normalized by the summed amplitude.
+    """
+    permutation = get_permutation(seed)
+    result = np.empty((height, width), dtype=np.float32)
+    xs = np.arange(height, dtype=np.float64)[:, None] * scale
+    ys = np.arange(width, dtype=np.float64)[None, :] * scale
+
+    amplitude_sum = sum(persistence**octave for octave in range(int(octaves)))
+    for start in range(0, height, BAND_ROWS):
+        band = result[start : start + BAND_ROWS]
+        band.fill(0)
+        frequency = 1.0
+        amplitude = 1.0
+        for _ in range(int(octaves)):
+            band += amplitude * gradient_noise(
+                xs[start : start + BAND_ROWS] * frequency, ys * frequency, permutation
+            )
+            frequency *= lacunarity
+            amplitude *= persistence
+        if amplitude_sum:
+            band /= amplitude_sum
+    return result
+
+
+def tileable_perlin_noise(
+    size: int,
+    scale: float = 0.1,
+    octaves: int = 1,
+    persistence: float = 0.5,
+    lacunarity: float = 2.0,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Generates square fractal perlin noise which wraps around at its edges
+
+    scale and the frequency of every octave are rounded so that the tile
+    spans a whole number of lattice cells.
+    """
+    period = max(1, round(size * scale))
+    permutation = get_permutation(seed)
+    result = np.zeros((size, size), dtype=np.float32)
+    coordinates = np.arange(size, dtype=np.float64) / size
+
+    amplitude = 1.0
+    amplitude_sum = 0.0
+    frequency = 1.0
+    for _ in range(int(octaves)):
+        cells = max(1, round(period * frequency))
+        result += amplitude * gradient_noise(
+            coordinates[:, None] * cells,
+            coordinates[None, :] * cells,
+            permutation,
+            cells,
+        )
+        amplitude_sum += amplitude
+        frequency *= lacunarity
+        amplitude *= persistence
+    if amplitude_sum:
+        result /= amplitude_sum
+    return result
+
+
+def tile(
+    atlas: np.ndarray, height: int, width: int, top: int = 0, left: int = 0, out=None
+) -> np.ndarray:
+    """
+    Copies the atlas repeatedly into an image of given size, starting at
+    (top, left) of the atlas, converting to the type of out
+    """
+    if out is None:
+        out = np.empty((height, width) + atlas.shape[2:], dtype=atlas.dtype)
+    rows, cols = atlas.shape[:2]
+    top, left = top % rows, left % cols
+    y = 0
+    while y < height:
+        source_top = (top + y) % rows
+        block_rows = min(rows - source_top, height - y)
+        x = 0
+        while x < width:
+            source_left = (left + x) % cols
+            block_cols = min(cols - source_left, width - x)
+            out[y : y + block_rows, x : x + block_cols] = atlas[
+                source_top : source_top + block_rows,
+                source_left : source_left + block_cols,
+            ]
+            x += block_cols
+        y += block_rows
+    return out
@@ -0,0 +1,435 @@
+"""
+Declarative registry of the effects of the editor
+
+Every effect declares its parameters with their ranges, its cost class and
+whether its output is worth caching. The State fields, the controls of the
+control panel and the pipeline stages are generated from the registry.
+
+Other packages add effects through the "bart.effects" entry point group,
+an entry point refers to an Effect, a list of them or a callable returning
+them, e.g. in pyproject.toml:
+    [project.entry-points."bart.effects"]
+    sepia = "bart_sepia:SEPIA"
+Finding them takes tens of milliseconds, so plugins are not registered
+automatically, load_plugins returns them for register_effect. The GUI
+loads them in the background after its window shows.
+
+OpenCV and NumPy are imported only when stages are created, so the GUI can
+build its controls without them.
+"""
+import warnings
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Union
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+ENTRY_POINT_GROUP = "bart.effects"
+
+# cost classes, they decide how the pipeline schedules the stage
+# every pixel on its own, adjacent ones with a lut are fused into one table
+POINT = "point"
+# bounded kernel, tiled with a halo of the kernel radius
+NEIGHBOURHOOD = "neighbourhood"
+# depends on the whole image or pixel position, never tiled
+GLOBAL = "global"
+COST_CLASSES = (POINT, NEIGHBOURHOOD, GLOBAL)
+
+# kinds of parameters and the generated controls
+SLIDER = "slider"
+# button switching the effect on and off
+TOGGLE = "toggle"
+CHECK = "check"
+# set by custom controls, no control is generated
+VALUE = "value"
+KINDS = (SLIDER, TOGGLE, CHECK, VALUE)
+
+# order of effects without a declared one, after the built in effects
+PLUGIN_ORDER = 1000
+
+
+class Param:
+    """Parameter of an effect stored as a State field"""
+
+    def __init__(
+        self,
+        name: str,
+        label: str = "",
+        minimum: int = 0,
+        maximum: int = 1,
+        default=None,
+        kind: str = SLIDER,
+        key: Optional[str] = None,
+        factor: float = 1,
+        odd: bool = False,
+    ):
+        """
+        name - State field, unique among all effects
+        label - text of the generated control
+        minimum, maximum - slider range
+        default - defaults to minimum for sliders and False for switches
+        key - effect parameter receiving the value times factor, defaults
+              to name, toggles enable the stage instead
+        odd - slider accepts only odd values
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown parameter kind: %s" % kind)
+        if default is None and kind == SLIDER:
+            default = minimum
+        elif default is None and kind in (TOGGLE, CHECK):
+            default = False
+        if kind == SLIDER and not minimum <= default <= maximum:
+            raise ValueError("Default of %s is out of range" % name)
+        self.name = name
+        self.label = label
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.kind = kind
+        self.key = name if key is None else key
+        self.factor = factor
+        self.odd = odd
+
+
+class Effect:
+    """Declaration of an effect and its pipeline stage"""
+
+    def __init__(
+        self,
+        name: str,
+        function: Union[str, Callable],
+        params: Sequence[Param] = (),
+        cost: str = NEIGHBOURHOOD,
+        cacheable: bool = True,
+        order: float = PLUGIN_ORDER,
+        defaults: Optional[dict] = None,
+        is_active: Callable[[dict], bool] = lambda params: True,
+        get_params: Optional[Callable[[dict, bool], dict]] = None,
+        scale_params: Optional[Callable[[dict, float], dict]] = None,
+        lut: Optional[Callable[[dict], "ndarray"]] = None,
+        takes_lut: bool = False,
+        in_place: bool = False,
+        halo: Optional[Callable[[dict], Optional[int]]] = None,
+    ):
+        """
+        name - pipeline stage name
+        function - the effect or name of an ImageEffects method
+        cost - cost class, see POINT, NEIGHBOURHOOD and GLOBAL
+        cacheable - keep output of the stage between renders, cheap stages
+                    are recomputed instead
+        order - position in the pipeline, lower first
+        defaults - stage parameters not set from State fields
+        get_params - maps State values to stage parameters, by default
+                     every parameter is passed as its key
+        halo - kernel radius for tiling, see tile_utils.get_halo
+        See Stage for the other arguments.
+        """
+        if cost not in COST_CLASSES:
+            raise ValueError("Unknown cost class: %s" % cost)
+        self.name = name
+        self.function = function
+        self.params = tuple(params)
+        self.cost = cost
+        self.cacheable = cacheable
+        self.order = order
+        self.defaults = dict(defaults or {})
+        self.is_active = is_active
+        self._get_params = get_params
+        self.scale_params = scale_params
+        self.lut = lut
+        self.takes_lut = takes_lut
+        self.in_place = in_place
+        self.halo = halo
+
+    def get_function(self) -> Callable:
+        if callable(self.function):
+            return self.function
+        from utils.ImageEffects import ImageEffects
+
+        return getattr(ImageEffects, self.function)
+
+    def get_params(self, values: dict, export: bool = False) -> dict:
+        """
+        Returns stage parameters for State values
+
+        export - the render is saved, interactive shortcuts are not used
+        """
+        if self._get_params is not None:
+            return self._get_params(values, export)
+        params = {}
+        for param in self.params:
+            value = values[param.name]
+            if param.kind == TOGGLE:
+                params["enabled"] = value
+            elif param.factor != 1:
+                params[param.key] = value * param.factor
+            else:
+                params[param.key] = value
+        return params
+
+    def get_default_params(self) -> dict:
+        """
+        Returns stage parameters for default values of the parameters
+        """
+        values = {param.name: param.default for param in self.params}
+        return dict(self.defaults, **self.get_params(values, export=True))
+
+
+def _scale_odd_kernel(params: dict, scale: float) -> dict:
+    size = max(1, int(round(params["degree"] * scale)))
+    params["degree"] = size if size % 2 == 1 else size + 1
+    return params
+
+
+def _scale_unsharp(params: dict, scale: float) -> dict:
+    params["radius"] = params.get("radius", 0) * scale
+    return params
+
+
+def _scale_noise(params: dict, scale: float) -> dict:
+    # sample the same noise field with fewer pixels
+    params["degree"] = params["degree"] / scale
+    return params
+
+
+def _scale_bilateral(params: dict, scale: float) -> dict:
+    if params["degree"] > 0:
+        params["degree"] = max(1, int(round(params["degree"] * scale)))
+    params["sigmaSpace"] = params.get("sigmaSpace", 20) * scale
+    return params
+
+
+def _scale_vignette(params: dict, scale: float) -> dict:
+    params["degree"] = params.get("degree", 300) * scale
+    return params
+
+
+def _scale_points(params: dict, scale: float) -> dict:
+    # points are given in full resolution coordinates
+    if params.get("points") is not None:
+        params["points"] = tuple((x * scale, y * scale) for x, y in params["points"])
+    return params
+
+
+def _get_brightness_lut(params: dict) -> "ndarray":
+    from utils.lut_utils import get_brightness_lut
+
+    return get_brightness_lut(params["degree"])
+
+
+def _get_rgb_lut(params: dict) -> "ndarray":
+    from utils.lut_utils import get_rgb_lut
+
+    return get_rgb_lut(params["color"])
+
+
+def _get_inverted_lut(params: dict) -> "ndarray":
+    from utils.lut_utils import get_inverted_lut
+
+    return get_inverted_lut()
+
+
+def _get_denoise_params(values: dict, export: bool) -> dict:
+    is_fast = values["is_fast_denoised"] and not export
+    return {"degree": values["denoise"], "mode": "fast" if is_fast else "exact"}
+
+
+def _get_geometry_params(values: dict, export: bool) -> dict:
+    return {
+        "angle": values["rotation"] + values["straighten"],
+        "points": values["warp_points"],
+    }
+
+
+BUILTIN_EFFECTS = (
+    Effect(
+        "sharpen",
+        "get_sharpen_image",
+        [Param("sharpen", "Zaostření", 0, 2, key="degree")],
+        order=10,
+        defaults={"radius": 0},
+        is_active=lambda p: p["degree"] > 0,
+        scale_params=_scale_unsharp,
+    ),
+    Effect(
+        "blur",
+        "get_blured_image",
+        [Param("blur", "Rozmazání", 1, 99, key="degree", odd=True)],
+        order=20,
+        is_active=lambda p: p["degree"] > 1,
+        scale_params=_scale_odd_kernel,
+    ),
+    Effect(
+        "brightness",
+        "get_brightness_modified_image",
+        [Param("exposure", "Jas", 0, 20, key="degree")],
+        POINT,
+        cacheable=False,
+        order=30,
+        is_active=lambda p: p["degree"] != 0,
+        lut=_get_brightness_lut,
+        in_place=True,
+    ),
+    Effect(
+        "rgb",
+        "get_rgb_modified_image",
+        [
+            Param("red", "Červená", -100, 100, 0),
+            Param("green", "Zelená", -100, 100, 0),
+            Param("blue", "Modrá", -100, 100, 0),
+        ],
+        POINT,
+        cacheable=False,
+        order=40,
+        is_active=lambda p: any(p["color"]),
+        get_params=lambda v, export: {"color": (v["red"], v["green"], v["blue"])},
+        lut=_get_rgb_lut,
+        in_place=True,
+    ),
+    Effect(
+        "contrast",
+        "get_contrast_modified_image",
+        [Param("contrast", "Kontrast", 0, 2, key="degree")],
+        GLOBAL,
+        order=50,
+        is_active=lambda p: p["degree"] > 0,
+        in_place=True,
+    ),
+    Effect(
+        "noise",
+        "get_noise",
+        [Param("perlin_noise", "Šum", 0, 2, key="degree", factor=0.01)],
+        GLOBAL,
+        order=60,
+        is_active=lambda p: p["degree"] > 0,
+        scale_params=_scale_noise,
+    ),
+    Effect(
+        "denoise",
+        "get_denoised_image",
+        [
+            Param("denoise", "Redukce šumu", 0, 50),
+            Param("is_fast_denoised", "Rychlý náhled", default=True, kind=CHECK),
+        ],
+        order=70,
+        is_active=lambda p: p["degree"] > 0,
+        get_params=_get_denoise_params,
+        scale_params=_scale_bilateral,
+    ),
+    Effect(
+        "vignette",
+        "get_vignette_image",
+        [Param("is_vignetted", "Vinětace", kind=TOGGLE)],
+        GLOBAL,
+        order=80,
+        scale_params=_scale_vignette,
+        in_place=True,
+    ),
+    Effect(
+        "emboss",
+        "get_embossed_image",
+        [Param("is_embossed", "Emboss", kind=TOGGLE)],
+        order=90,
+        takes_lut=True,
+    ),
+    Effect(
+        "invert",
+        "get_inverted_image_colors",
+        [Param("is_inverted", "Inverze barev", kind=TOGGLE)],
+        POINT,
+        cacheable=False,
+        order=100,
+        lut=_get_inverted_lut,
+        in_place=True,
+    ),
+    Effect(
+        "geometry",
+        "get_transformed_image",
+        [
+            Param("rotation", default=0, kind=VALUE),
+            Param("straighten", "Narovnání", -45, 45, 0),
+            # corners in full resolution coordinates, see get_warped_image
+            Param("warp_points", kind=VALUE),
+        ],
+        GLOBAL,
+        order=110,
+        is_active=lambda p: p["angle"] % 360 != 0 or p["points"] is not None,
+        get_params=_get_geometry_params,
+        scale_params=_scale_points,
+    ),
+)
+
+# effects registered by register_effect
+_registered = []
+
+
+def register_effect(effect: Effect) -> None:
+    """
+    Adds effect to the registry, pipelines created before keep their stages
+    """
+    _registered.append(effect)
+    get_effects.cache_clear()
+    get_fields.cache_clear()
+
+
+def load_plugins() -> List[Effect]:
+    """
+    Returns effects of the installed plugins without registering them
+
+    Plugins which fail to load are skipped with a warning. Thread safe.
+    """
+    # importlib.metadata takes tens of milliseconds to import
+    from importlib.metadata import entry_points
+
+    try:
+        selected = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        selected = entry_points().get(ENTRY_POINT_GROUP, [])
+    effects = []
+    for entry_point in selected:
+        try:
+            loaded = entry_point.load()
+            if callable(loaded) and not isinstance(loaded, Effect):
+                loaded = loaded()
+            loaded = [loaded] if isinstance(loaded, Effect) else list(loaded)
+            if not all(isinstance(effect, Effect) for effect in loaded):
+                raise TypeError("entry point must provide Effect instances")
+        except Exception as exc:
+            warnings.warn(
+                "Could not load effect plugin %s: %s" % (entry_point.name, exc)
+            )
+            continue
+        effects.extend(loaded)
+    return effects
+
+
+@lru_cache(maxsize=None)
+def get_effects() -> tuple:
+    """
+    Returns built in and registered effects in pipeline order
+
+    Effects whose stage name or parameter names are already taken are
+    skipped with a warning.
+    """
+    effects = []
+    names = set()
+    fields = set()
+    for effect in BUILTIN_EFFECTS + tuple(_registered):
+        params = {param.name for param in effect.params}
+        if effect.name in names or params & fields:
+            warnings.warn("Effect %s conflicts with another effect" % effect.name)
+            continue
+        effects.append(effect)
+        names.add(effect.name)
+        fields |= params
+    # sort is stable, effects of the same order keep registration order
+    return tuple(sorted(effects, key=lambda effect: effect.order))
+
+
+@lru_cache(maxsize=None)
+def get_fields() -> Dict[str, Param]:
+    """
+    Returns parameters of all effects by name in pipeline order
+    """
+    return {param.name: param for effect in get_effects() for param in effect.params}
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Tuple
+
+import numpy as np
+from utils.convolution_utils import get_gaussian_size
+
+# default tile edge in pixels, about 12 MB per 3 channel uint8 tile with halo
+TILE_SIZE = 2048
+
+
+def _get_bilateral_halo(params: dict) -> Optional[int]:
+    if params.get("mode") == "fast":
+        # guided filter works on a resampled image, tiles would not match
+        return None
+    # same radius as cv2.bilateralFilter
+    degree = params.get("degree", 10)
+    if degree <= 0:
+        return max(1, round(params.get("sigmaSpace", 20) * 1.5))
+    return max(1, degree // 2)
+
+
+def _get_sharpen_halo(params: dict) -> int:
+    radius = params.get("radius", 0)
+    return get_gaussian_size(radius) // 2 if radius > 0 else 1
+
+
+# neighbourhood effects which can be tiled and the radius of their kernel
+HALOS = {
+    "get_sharpen_image": _get_sharpen_halo,
+    "get_embossed_image": lambda params: 1,
+    "get_blured_image": lambda params: params.get("degree", 1) // 2,
+    "get_denoised_image": _get_bilateral_halo,
+}
+
+
+def get_halo(effect: Callable, params: dict) -> Optional[int]:
+    """
+    Returns kernel radius of the effect, None if it cannot be tiled
+    """
+    halo = HALOS.get(getattr(effect, "__name__", ""))
+    return None if halo is None else halo(params)
+
+
+def get_tiles(
+    height: int, width: int, tile_size: int
+) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Yields (top, bottom, left, right) of tiles covering the image
+    """
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield top, min(top + tile_size, height), left, min(left + tile_size, width)
+
+
+def apply_tiled(
+    effect: Callable,
+    image: np.ndarray,
+    halo: int,
+    tile_size: int = TILE_SIZE,
+    workers: int = 1,
+    **params
+) -> np.ndarray:
+    """
+    Applies neighbourhood effect over overlapping tiles
+
+    Every tile is extended by halo pixels so the result is the same as
+    applying the effect to the whole image up to +-1 rounding at the image
+    border, where OpenCV may take another code path for the narrower tile.
+    Temporaries stay tile sized.
+    """
+    height, width = image.shape[:2]
+    if height <= tile_size and width <= tile_size:
+        return effect(image, **params)
+
+    def process(tile: Tuple[int, int, int, int]) -> None:
+        top, bottom, left, right = tile
+        y0, y1 = max(0, top - halo), min(height, bottom + halo)
+        x0, x1 = max(0, left - halo), min(width, right + halo)
+        result = effect(image[y0:y1, x0:x1], **params)
+        output[top:bottom, left:right] = result[
+            top - y0 : bottom - y0, left - x0 : right - x0
+        ]
+
+    tiles = get_tiles(height, width, tile_size)
+    # the first tile determines shape and type of the output
+    first = next(tiles)
+    top, bottom, left, right = first
+    sample = effect(image[top : bottom + halo, left : right + halo], **params)
+    output = np.empty((height, width) + sample.shape[2:], dtype=sample.dtype)
+    output[top:bottom, left:right] = sample[: bottom - top, : right - left]
+    del sample
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(process, tile) for tile in tiles]:
+                future.result()
+    else:
+        for tile in tiles:
+            process(tile)
+    return output
@@ -0,0 +1,207 @@
+"""
+Timing of pipeline stages, rendering and display
+
+Code is instrumented with span(name) contexts. They do nothing until a
+Tracer is installed with set_tracer, which keeps the latest duration of
+every span for the GUI overlay and optionally appends every span to a
+JSON lines file of Chrome trace events. The file can be summarized or
+converted for chrome://tracing and https://ui.perfetto.dev:
+
+Usage (from the bart directory):
+    BART_TRACE=trace.jsonl python Bart.py
+    python Bart.py trace trace.jsonl [-o trace.json]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+
+# path of the trace file written from the start of the GUI
+TRACE_ENV = "BART_TRACE"
+
+# (name, category, start, duration) in seconds
+Span = Tuple[str, str, float, float]
+
+_NULL_SPAN = nullcontext()
+_tracer = None
+
+
+class Tracer:
+    """
+    Records durations of spans by thread
+
+    Only the latest span of every name is kept in memory, all spans are
+    written to the optional trace file. Thread safe.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self._latest = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        args: Optional[dict] = None,
+    ) -> None:
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._latest[thread_id][name] = (name, category, start, end - start)
+            if self._file is not None:
+                event = {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": round(start * 1e6, 1),
+                    "dur": round((end - start) * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": thread_id,
+                }
+                if args:
+                    event["args"] = args
+                self._file.write(json.dumps(event) + "\n")
+
+    def get_latest(self, thread_id: Optional[int] = None) -> List[Span]:
+        """
+        Returns latest span of every name recorded by the thread, by start
+        """
+        if thread_id is None:
+            thread_id = threading.get_ident()
+        with self._lock:
+            spans = list(self._latest.get(thread_id, {}).values())
+        return sorted(spans, key=lambda span: span[2])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.tracer.record(
+            self.name, self.category, self.start, time.perf_counter(), self.args
+        )
+
+
+def span(name: str, category: str = "stage", **args):
+    """
+    Returns context timing its body, a shared no-op one when not tracing
+
+    The span is given as the context target (None when not tracing), its
+    name can be changed before the context exits.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    """
+    Installs the tracer for all threads, None disables tracing
+
+    The previous tracer is closed.
+    """
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    if previous is not None and previous is not tracer:
+        previous.close()
+
+
+def load_trace(path: str) -> List[dict]:
+    """
+    Returns events of a JSON lines trace, an unfinished last line is skipped
+    """
+    events = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def get_summary(events: List[dict]) -> List[str]:
+    """
+    Returns table of span names sorted by total time
+    """
+    durations: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    for event in events:
+        durations[event["cat"], event["name"]].append(event["dur"] / 1000)
+    lines = [
+        "%-10s %-32s %7s %10s %10s %10s"
+        % ("category", "span", "count", "total ms", "mean ms", "max ms")
+    ]
+    for (category, name), times in sorted(
+        durations.items(), key=lambda item: sum(item[1]), reverse=True
+    ):
+        lines.append(
+            "%-10s %-32s %7d %10.1f %10.2f %10.2f"
+            % (
+                category,
+                name,
+                len(times),
+                sum(times),
+                sum(times) / len(times),
+                max(times),
+            )
+        )
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="bart trace", description="Summarize or convert a timing trace"
+    )
+    parser.add_argument("trace", help="JSON lines trace written by the GUI")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="write Chrome trace JSON for chrome://tracing or Perfetto",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        events = load_trace(args.trace)
+    except OSError as exc:
+        print("%s: %s" % (type(exc).__name__, exc), file=sys.stderr)
+        return 1
+    for line in get_summary(events):
+        print(line)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Streaming of video files and image sequences through an effect recipe
+
+Frames are decoded by a reader thread into a bounded queue, processed in
+order and encoded by a writer thread, so decoding, effects and encoding
+overlap while memory stays bounded by the queue size. Decoded frame
+buffers are recycled by the reader.
+
+Usage (from the bart directory):
+    python Bart.py video recipe.json clip.mp4 -o out.mp4
+    python Bart.py video recipe.json "frames/%04d.png" -o "out/%04d.png"
+"""
+import argparse
+import inspect
+import os
+import sys
+import time
+from collections import defaultdict
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Callable, List, Optional
+
+from cv2 import CAP_IMAGES, CAP_PROP_FPS, VideoCapture, VideoWriter, VideoWriter_fourcc
+from numpy import ndarray
+from utils.ImageEffects import ImageEffects
+from utils.batch import Recipe, load_recipe
+
+# number of frames waiting for processing and for writing
+QUEUE_SIZE = 8
+# used when the input does not report its frame rate, e.g. image sequences
+DEFAULT_FPS = 25.0
+# codec of the output by extension, image sequences need none
+FOURCCS = {".mp4": "mp4v", ".mov": "mp4v", ".avi": "MJPG", ".mkv": "XVID"}
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class StageTimes:
+    """
+    Accumulated time per pipeline stage, safe to add from one thread per stage
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.frames = defaultdict(int)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.seconds[name] += seconds
+        self.frames[name] += 1
+
+    def get_frame_time(self, name: str) -> float:
+        """
+        Returns mean time per frame in seconds
+        """
+        return self.seconds[name] / max(1, self.frames[name])
+
+    def get_report(self, elapsed: float, frames: int) -> List[str]:
+        """
+        Returns table of stages sorted by time with the limiting stage
+
+        Reading and writing overlap with the effects, the slowest of read,
+        effects and write bounds the frame rate.
+        """
+        effects = [name for name in self.seconds if name not in ("read", "write")]
+        lines = ["%-32s %9s %7s %8s" % ("stage", "ms/frame", "share", "max fps")]
+        total = sum(self.get_frame_time(name) for name in effects)
+        for name in sorted(effects, key=self.get_frame_time, reverse=True):
+            frame_time = self.get_frame_time(name)
+            lines.append(
+                "%-32s %9.2f %6.1f%% %8.1f"
+                % (
+                    name,
+                    frame_time * 1000,
+                    100 * frame_time / total if total else 0,
+                    1 / frame_time if frame_time else float("inf"),
+                )
+            )
+        for name in ("read", "write"):
+            frame_time = self.get_frame_time(name)
+            lines.append(
+                "%-32s %9.2f %7s %8.1f"
+                % (name, frame_time * 1000, "", 1 / frame_time if frame_time else 0)
+            )
+        bounds = {"read": self.get_frame_time("read"), "effects": total}
+        bounds["write"] = self.get_frame_time("write")
+        limit = max(bounds, key=bounds.get)
+        if limit == "effects" and effects:
+            limit = max(effects, key=self.get_frame_time)
+        lines.append(
+            "Processed %d frames in %.2f s (%.1f fps), limited by %s"
+            % (frames, elapsed, frames / elapsed if elapsed else 0, limit)
+        )
+        return lines
+
+
+def get_fourcc(output: str, fourcc: Optional[str] = None) -> int:
+    """
+    Returns codec of the output, 0 for image sequences
+    """
+    suffix = os.path.splitext(output)[1].lower()
+    if fourcc is None:
+        if suffix in IMAGE_SUFFIXES:
+            return 0
+        fourcc = FOURCCS.get(suffix, "mp4v")
+    return VideoWriter_fourcc(*fourcc)
+
+
+def _takes(effect: Callable, parameter: str) -> bool:
+    return parameter in inspect.signature(effect).parameters
+
+
+def apply_recipe_timed(
+    image: ndarray, recipe: Recipe, times: StageTimes, frame: int = 0
+) -> ndarray:
+    """
+    Applies recipe effects to the frame and records time of every effect
+
+    The input frame is left intact, effects supporting in_place overwrite
+    the intermediate results of previous effects. Animated effects like
+    get_grain_image receive the frame index.
+    """
+    owned = False
+    for name, params in recipe:
+        effect = getattr(ImageEffects, name)
+        params = dict(params)
+        if owned and _takes(effect, "in_place"):
+            params["in_place"] = True
+        if "frame" not in params and _takes(effect, "frame"):
+            params["frame"] = frame
+        start = time.perf_counter()
+        result = effect(image, **params)
+        times.add(name, time.perf_counter() - start)
+        owned = owned or result is not image
+        image = result
+    return image
+
+
+def _put(queue: Queue, item, stop: Event) -> bool:
+    # blocks while the queue is full, gives up when the stream is stopped
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _get(queue: Queue, stop: Event):
+    # returns None when the stream is stopped
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            pass
+    return None
+
+
+def _read_frames(
+    capture: VideoCapture,
+    frames: Queue,
+    buffers: Queue,
+    stop: Event,
+    times: StageTimes,
+    errors: list,
+) -> None:
+    try:
+        while not stop.is_set():
+            try:
+                buffer = buffers.get_nowait()
+            except Empty:
+                buffer = None
+            start = time.perf_counter()
+            ok, frame = capture.read(buffer)
+            if not ok:
+                break
+            times.add("read", time.perf_counter() - start)
+            if not _put(frames, frame, stop):
+                break
+    except Exception as exc:
+        errors.append(exc)
+    finally:
+        _put(frames, None, stop)
+
+
+def _write_frames(
+    output: str,
+    fourcc: int,
+    fps: float,
+    results: Queue,
+    stop: Event,
+    times: StageTimes,
+    errors: list,
+) -> None:
+    writer = None
+    try:
+        while True:
+            frame = _get(results, stop)
+            if frame is None:
+                break
+            start = time.perf_counter()
+            if writer is None:
+                # effects may rotate or convert to grayscale, the first
+                # processed frame determines size and color of the output
+                size = frame.shape[1], frame.shape[0]
+                if fourcc:
+                    writer = VideoWriter(output, fourcc, fps, size, frame.ndim == 3)
+                else:
+                    # encoded by imwrite, codec follows the file extension
+                    writer = VideoWriter(
+                        output, CAP_IMAGES, 0, fps, size, frame.ndim == 3
+                    )
+                if not writer.isOpened():
+                    raise IOError("Could not open video writer: %s" % output)
+            writer.write(frame)
+            times.add("write", time.perf_counter() - start)
+    except Exception as exc:
+        errors.append(exc)
+        stop.set()
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def run(
+    recipe: Recipe,
+    input_path: str,
+    output: str,
+    fourcc: Optional[str] = None,
+    queue_size: int = QUEUE_SIZE,
+    stream=sys.stdout,
+) -> StageTimes:
+    """
+    Streams all frames of the input through the recipe into the output
+
+    input_path and output are video files or printf style image sequence
+    patterns like frames/%04d.png. Returns time spent in every stage.
+    """
+    capture = VideoCapture(input_path)
+    if not capture.isOpened():
+        raise FileNotFoundError("Could not open video: %s" % input_path)
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fps = capture.get(CAP_PROP_FPS) or DEFAULT_FPS
+
+    times = StageTimes()
+    frames, results = Queue(queue_size), Queue(queue_size)
+    # decoded frames are given back to the reader once processed
+    buffers = Queue(queue_size + 2)
+    stop = Event()
+    errors = []
+    reader = Thread(
+        target=_read_frames,
+        args=(capture, frames, buffers, stop, times, errors),
+        daemon=True,
+    )
+    writer = Thread(
+        target=_write_frames,
+        args=(output, get_fourcc(output, fourcc), fps, results, stop, times, errors),
+        daemon=True,
+    )
+    count = 0
+    start = time.perf_counter()
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            frame = _get(frames, stop)
+            if frame is None:
+                break
+            result = apply_recipe_timed(frame, recipe, times, count)
+            if not _put(results, result, stop):
+                break
+            if result is not frame:
+                try:
+                    buffers.put_nowait(frame)
+                except Full:
+                    pass
+            count += 1
+        _put(results, None, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        reader.join()
+        writer.join()
+        capture.release()
+    if errors:
+        raise errors[0]
+
+    for line in times.get_report(time.perf_counter() - start, count):
+        print(line, file=stream)
+    return times
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="bart video", description="Apply effect recipe to video or frames"
+    )
+    parser.add_argument("recipe", help="JSON or YAML recipe file")
+    parser.add_argument("input", help="video file or image sequence like %%04d.png")
+    parser.add_argument(
+        "-o", "--output", required=True, help="video file or image sequence pattern"
+    )
+    parser.add_argument(
+        "--fourcc", default=None, help="output codec, derived from extension"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=QUEUE_SIZE,
+        help="frames buffered between reading, effects and writing",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+        run(recipe, args.input, args.output, args.fourcc, args.queue_size)
+    except Exception as exc:
+        # invalid recipes and parameter values fail like in batch mode
+        print("%s: %s" % (type(exc).__name__, exc), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())